@@ -2,9 +2,8 @@
 
 import os
 import sys
-from lib.config import load_env_variables, update_env_variables
+from lib.config import load_env_variables, update_env_variables, update_env_variables_batch
 from lib.bh_utils import verify_access
-from time import sleep
 from lib.utils import (
     login_get_token,
     create_initial_api_key,
@@ -14,8 +13,6 @@ from lib.utils import (
     retrieve_initial_password,
 )
 
-rate_limit_sleep = 0.2
-
 
 def debug_print(message):
     if os.getenv("DEBUG", "").lower() == "true":
@@ -49,7 +46,6 @@ def authenticate():
     if env_vars.get("token_id") and env_vars.get("token_key"):
         if verify_access():
             debug_print("Existing tokens work fine")
-            sleep(rate_limit_sleep)
             return True
         debug_print("Tokens expired, need to re-authenticate")
 
@@ -67,7 +63,6 @@ def authenticate():
 
     # Try login
     result = login_get_token("POST", "/api/v2/login", username, password)
-    sleep(rate_limit_sleep)
 
     if not result or not result[0]:
         # Login failed, try with initial password from docker
@@ -80,7 +75,6 @@ def authenticate():
 
         update_env_variables("BHE_INITIAL_PASSWORD", initial_password)
         result = login_get_token("POST", "/api/v2/login", username, initial_password)
-        sleep(rate_limit_sleep)
 
         if not result or not result[0]:
             debug_print("Initial password also failed")
@@ -92,7 +86,6 @@ def authenticate():
         response = change_password(
             "PUT", f"/api/v2/bloodhound-users/{user_id}/secret", session_token, initial_password, password
         )
-        sleep(rate_limit_sleep)
 
         if response.status_code != 200:
             debug_print("Failed to change password")
@@ -100,7 +93,6 @@ def authenticate():
 
         update_env_variables("BHE_PASSWORD", password)
         result = login_get_token("POST", "/api/v2/login", username, password)
-        sleep(rate_limit_sleep)
         if not result or not result[0]:
             return False
 
@@ -117,16 +109,13 @@ def authenticate():
         response = change_password(
             "PUT", f"/api/v2/bloodhound-users/{user_id}/secret", session_token, password, new_password
         )
-        sleep(rate_limit_sleep)
         if response.status_code != 200:
             debug_print("Password change failed")
             return False
 
-        update_env_variables("BHE_PASSWORD", new_password)
-        update_env_variables("BHE_NEW_PASSWORD", "none")
+        update_env_variables_batch({"BHE_PASSWORD": new_password, "BHE_NEW_PASSWORD": "none"})
 
         result = login_get_token("POST", "/api/v2/login", username, new_password)
-        sleep(rate_limit_sleep)
         if not result or not result[0]:
             return False
 
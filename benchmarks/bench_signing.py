@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Per-request signing overhead: full HMAC chain rebuilt every time (previous _request code)
+versus lib.signer.RequestSigner with cached method + path / hour links.
+
+usage: python3 benchmarks/bench_signing.py [-n ITERATIONS]
+"""
+
+import argparse
+import base64
+import datetime
+import hashlib
+import hmac
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lib.signer as signer  # noqa: E402
+
+TOKEN_ID = "00000000-0000-0000-0000-000000000000"
+TOKEN_KEY = "benchmark-token-key-benchmark-token-key"
+METHOD = "POST"
+PATH = "/api/v2/saved-queries"
+BODY = b'{"name": "benchmark", "query": "MATCH (n:User) RETURN n LIMIT 10", "description": ""}'
+
+
+def sign_full_chain(method, path, body, now=None):
+    digester = hmac.new(TOKEN_KEY.encode(), None, hashlib.sha256)
+    digester.update(f"{method}{path}".encode())
+    digester = hmac.new(digester.digest(), None, hashlib.sha256)
+    datetime_formatted = (now or datetime.datetime.now().astimezone()).isoformat("T")
+    digester.update(datetime_formatted[:13].encode())
+    digester = hmac.new(digester.digest(), None, hashlib.sha256)
+    if body is not None:
+        digester.update(body)
+    return datetime_formatted, base64.b64encode(digester.digest())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="request signing benchmark")
+    parser.add_argument("-n", "--iterations", type=int, default=100000, help="Signatures per run (default 100000)")
+    args = parser.parse_args()
+
+    request_signer = signer.RequestSigner(TOKEN_ID, TOKEN_KEY)
+    # both produce the same signature
+    now = datetime.datetime.now().astimezone()
+    assert request_signer.sign(METHOD, PATH, BODY, now) == sign_full_chain(METHOD, PATH, BODY, now)
+
+    cases = [
+        ("full chain", lambda: sign_full_chain(METHOD, PATH, BODY)),
+        ("cached signer", lambda: request_signer.sign(METHOD, PATH, BODY)),
+    ]
+    print(f"{'signing':<16} {'us / request':>14}")
+    for label, func in cases:
+        best = min(timeit.repeat(func, number=args.iterations, repeat=5))
+        print(f"{label:<16} {best / args.iterations * 1e6:>14.2f}")
+    print(request_signer.stats())
+
+
+if __name__ == "__main__":
+    main()
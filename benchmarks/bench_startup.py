@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Startup time of bhtk.py commands.
+
+Runs each command in a fresh interpreter several times and prints the best / median wall time,
+then the slowest imports of the first command (python -X importtime).
+
+usage: python3 benchmarks/bench_startup.py [-n RUNS] [command args ...]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BHTK = os.path.join(ROOT_DIR, "bhtk.py")
+
+DEFAULT_COMMANDS = [["-db"], ["-ldb"], ["-nb", "-h"]]
+
+
+def time_command(command, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, BHTK] + command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def time_command_python(runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"])
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def slowest_imports(command, top=10):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", BHTK] + command,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        imports.append((int(cumulative), name.rstrip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="bhtk.py startup benchmark")
+    parser.add_argument("-n", "--runs", type=int, default=10, help="Runs per command (default 10)")
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="bhtk.py arguments (default: -db, -ldb, -nb -h)")
+    args = parser.parse_args()
+
+    commands = [args.command] if args.command else DEFAULT_COMMANDS
+    baseline = time_command_python(args.runs)
+    print(f"{'command':<20} {'best (ms)':>10} {'median (ms)':>12}")
+    print(f"{'python -c pass':<20} {min(baseline) * 1000:>10.1f} {statistics.median(baseline) * 1000:>12.1f}")
+    for command in commands:
+        timings = time_command(command, args.runs)
+        label = " ".join(command)
+        print(f"{label:<20} {min(timings) * 1000:>10.1f} {statistics.median(timings) * 1000:>12.1f}")
+
+    print(f"\nslowest imports for: {' '.join(commands[0])}")
+    for cumulative, name in slowest_imports(commands[0]):
+        print(f"{cumulative / 1000:>10.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,107 +1,236 @@
-import lib.utils as utils
-import lib.queries as queries
-import lib.bh_utils as bh_utils
 import argparse
-import lib.banner as banner
-import lib.config as config
 import sys
-import os
-import auth_flow
-import time
 
 # bloodhound toolkit cli
-docker_compose_dir = config.load_env_variables()["docker_compose_dir"]
-neo4j_data_dir = f"{docker_compose_dir}/data/neo4j-data"
-
-# argparse
-parser = argparse.ArgumentParser(description="Bloodhound Toolkit CLI")
-parser.add_argument("--start-containers", "-start", action="store_true", help="Start docker compose containers")
-parser.add_argument("--stop-containers", "-stop", action="store_true", help="Stop docker compose containers")
-parser.add_argument("--restart-containers", "-rc", action="store_true", help="Restart docker compose containers")
-parser.add_argument("--docker-logs", "-dl", action="store_true", help="Show docker logs")
-parser.add_argument(
-    "--initial-config",
-    "-init",
-    action="store_true",
-    help="Initial configuration. Will retrieve initial password, change password, create api key and update .env",
-)
-parser.add_argument(
-    "--change-password",
-    "-cp",
-    action="store_true",
-    help="Change password. Set the BHE_NEW_PASSWORD in .env. To be used after initial configuration",
-)
-parser.add_argument("--list-databases", "-ldb", action="store_true", help="List databases")
-parser.add_argument("--current-db", "-db", action="store_true", help="Currently used database")
-parser.add_argument("--set-database", "-sdb", help="Change / set database to use")
-parser.add_argument("--clear-database", "-cdb", action="store_true", help="Clear database")
-parser.add_argument(
-    "--import-specterops-queries", "-isq", action="store_true", help="Import SpecterOps queries from github"
-)
-parser.add_argument("--import-custom-queries", "-icq", help="Import custom queries from file or url")
-parser.add_argument("--import-custom-icons", "-ici", help="Import custom node icons from file or url")
-parser.add_argument("--old", action="store_true", help="Convert legacy query format before importing (use with -icq)")
-parser.add_argument("--delete-all-queries", "-dq", action="store_true", help="Delete all custom queries")
-parser.add_argument("--retrieve-initial-password", "-rip", action="store_true", help="Retrieve initial password")
-parser.add_argument("--create-api-key", "-cak", action="store_true", help="Create API key")
-parser.add_argument(
-    "--update-api-key", "-uak", action="store_true", help="Update .env with API key (to be used with --create-api-key)"
-)
-parser.add_argument("--verify-access", "-va", action="store_true", help="Verify access to BloodHound")
-parser.add_argument("--upload-collection", "-uc", help="Specify a folder containing json data or a zip file")
-parser.add_argument("--run-analysis", "-ra", action="store_true", help="Run analysis on data")
-parser.add_argument("--no-banner", "-nb", action="store_true", help="Don't show banner")
-parser.add_argument("--set-queries-public", "-sqp", action="store_true", help="Set queries permissions to public")
-args = parser.parse_args()
-
-# if no arguments, print help
-if len(sys.argv) == 1:
-    parser.print_help()
+# every command is a handler importing what it needs when it runs, local-only commands (-db, -ldb)
+# don't load requests, the API client or the banner fonts.
+
+
+def build_parser():
+    # argparse
+    parser = argparse.ArgumentParser(description="Bloodhound Toolkit CLI")
+    parser.add_argument("--start-containers", "-start", action="store_true", help="Start docker compose containers")
+    parser.add_argument("--stop-containers", "-stop", action="store_true", help="Stop docker compose containers")
+    parser.add_argument("--restart-containers", "-rc", action="store_true", help="Restart docker compose containers")
+    parser.add_argument(
+        "--ready-timeout",
+        type=int,
+        help="Seconds to wait for BloodHound to serve after -start, -rc, -sdb (default BHTK_READY_TIMEOUT or 300)",
+    )
+    parser.add_argument("--docker-logs", "-dl", action="store_true", help="Show docker logs")
+    parser.add_argument(
+        "--initial-config",
+        "-init",
+        action="store_true",
+        help="Initial configuration. Will retrieve initial password, change password, create api key and update .env",
+    )
+    parser.add_argument(
+        "--change-password",
+        "-cp",
+        action="store_true",
+        help="Change password. Set the BHE_NEW_PASSWORD in .env. To be used after initial configuration",
+    )
+    parser.add_argument("--list-databases", "-ldb", action="store_true", help="List databases")
+    parser.add_argument("--current-db", "-db", action="store_true", help="Currently used database")
+    parser.add_argument("--set-database", "-sdb", help="Change / set database to use")
+    parser.add_argument("--clear-database", "-cdb", action="store_true", help="Clear database")
+    parser.add_argument(
+        "--import-specterops-queries", "-isq", action="store_true", help="Import SpecterOps queries from github"
+    )
+    parser.add_argument("--import-custom-queries", "-icq", help="Import custom queries from file or url")
+    parser.add_argument("--import-custom-icons", "-ici", help="Import custom node icons from file or url")
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Only use the local cache for url sources (-isq, -icq, -ici), no download",
+    )
+    parser.add_argument(
+        "--old", action="store_true", help="Convert legacy query format before importing (use with -icq)"
+    )
+    parser.add_argument("--delete-all-queries", "-dq", action="store_true", help="Delete all custom queries")
+    parser.add_argument("--retrieve-initial-password", "-rip", action="store_true", help="Retrieve initial password")
+    parser.add_argument("--create-api-key", "-cak", action="store_true", help="Create API key")
+    parser.add_argument(
+        "--update-api-key",
+        "-uak",
+        action="store_true",
+        help="Update .env with API key (to be used with --create-api-key)",
+    )
+    parser.add_argument("--verify-access", "-va", action="store_true", help="Verify access to BloodHound")
+    parser.add_argument("--upload-collection", "-uc", help="Specify a folder containing json data or a zip file")
+    parser.add_argument(
+        "--zip-upload",
+        action="store_true",
+        help="Send a zip collection as is (application/zip) instead of its json files",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Number of concurrent requests for uploads (-uc, -buc) and saved queries operations, default 4",
+    )
+    parser.add_argument(
+        "--split-size",
+        type=int,
+        default=100,
+        help=(
+            "Upload json files bigger than this many MB as several smaller files "
+            "(use with -uc, -buc, default 100, 0 disables)"
+        ),
+    )
+    parser.add_argument(
+        "--validate-collection",
+        "-vc",
+        help="Validate the json files of a collection (folder or zip) and write its manifest, nothing is uploaded",
+    )
+    parser.add_argument(
+        "--validate",
+        action="store_true",
+        help="Validate collections before uploading them, invalid files are not uploaded (use with -uc, -buc)",
+    )
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        help="Only upload the objects that are new or changed since the last delta upload (use with -uc)",
+    )
+    parser.add_argument(
+        "--skip-unchanged",
+        action="store_true",
+        help="Don't upload files already ingested into the current database (use with -uc, -buc)",
+    )
+    parser.add_argument(
+        "--gzip",
+        action="store_true",
+        help="Send upload and saved queries / icons import bodies gzip encoded (falls back to plain if refused)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip the files a previous interrupted upload already sent (use with -uc, -buc)",
+    )
+    parser.add_argument(
+        "--batch-upload",
+        "-buc",
+        help="Upload many collections: a glob pattern (quoted) or a manifest file (.json list or one path per line)",
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=2, help="Number of upload jobs in flight (use with -buc, default 2)"
+    )
+    parser.add_argument(
+        "--summary", help="Path of the batch summary json (use with -buc, default data/batch_summary_*.json)"
+    )
+    parser.add_argument("--run-analysis", "-ra", action="store_true", help="Run analysis on data")
+    parser.add_argument(
+        "--wait-analysis",
+        action="store_true",
+        help="Wait until ingest / analysis are done (datapipe idle), after -ra it waits for that analysis",
+    )
+    parser.add_argument(
+        "--analysis-timeout", type=int, help="Give up waiting after this many seconds (use with --wait-analysis)"
+    )
+    parser.add_argument("--no-banner", "-nb", action="store_true", help="Don't show banner")
+    parser.add_argument("--set-queries-public", "-sqp", action="store_true", help="Set queries permissions to public")
+    parser.add_argument(
+        "--name-prefix", help="Only touch saved queries whose name starts with this (use with -dq, -sqp)"
+    )
+    parser.add_argument("--owner", help="Only touch saved queries owned by this user id (use with -dq, -sqp)")
+    parser.add_argument(
+        "--scope", help="Saved queries scope to list: owned, shared, public or all (use with -dq, -sqp)"
+    )
+    parser.add_argument(
+        "--instances",
+        nargs="?",
+        const="instances.json",
+        help="Run the API commands against every instance of this profiles file (default instances.json)",
+    )
+    parser.add_argument("--only", help="Comma separated instance names to run against (use with --instances)")
+    parser.add_argument(
+        "--max-parallel",
+        type=int,
+        default=4,
+        help="Number of instances handled at once (use with --instances, default 4)",
+    )
+    return parser
+
+
+def _neo4j_data_dir():
+    import lib.config as config
+
+    return f"{config.load_env_variables()['docker_compose_dir']}/data/neo4j-data"
+
+
+def _wait_ready(args):
+    import lib.readiness as readiness
+
+    result = readiness.wait_until_ready(args.ready_timeout)
+    if result["status"] == readiness.READY:
+        print(f"BloodHound is ready after {result['elapsed']}s")
+        return
+    print(f"[-] BloodHound not ready after {result['elapsed']}s ({result['status']}: {', '.join(result['waiting'])})")
     sys.exit(1)
 
-# if no banner, don't show banner
-if args.no_banner:
-    banner.generate_banner = lambda: None
-else:
-    banner.generate_banner()
 
 # start the containers
-if args.start_containers:
+def cmd_start_containers(args):
+    import lib.utils as utils
+
     utils.start_containers()
+    _wait_ready(args)
+
 
 # stop the containers
-if args.stop_containers:
+def cmd_stop_containers(args):
+    import lib.utils as utils
+
     utils.stop_containers()
 
+
 # restart the containers
-if args.restart_containers:
+def cmd_restart_containers(args):
+    import lib.utils as utils
+
     utils.restart_containers()
+    _wait_ready(args)
+
 
 # show docker logs
-if args.docker_logs:
+def cmd_docker_logs(args):
+    import lib.utils as utils
+
     utils.show_docker_logs()
 
+
 # verify access to BloodHound
-if args.verify_access:
+def cmd_verify_access(args):
+    import lib.bh_utils as bh_utils
+
     if bh_utils.verify_access():
         print("Access to BloodHound verified")
     else:
         print("Access to BloodHound failed")
 
+
 # list the databases
-if args.list_databases:
-    neo4j_databases = utils.list_neo4j_databases(neo4j_data_dir)
+def cmd_list_databases(args):
+    import lib.databases as databases
+
+    neo4j_databases = databases.list_neo4j_databases(_neo4j_data_dir())
     print(neo4j_databases)
 
 
 # get the current database
-if args.current_db:
-    current_db = utils.get_current_db()
+def cmd_current_db(args):
+    import lib.databases as databases
+
+    current_db = databases.get_current_db()
     print(f"Currently used database: {current_db}")
 
 
 # set the current database
-if args.set_database:
+def cmd_set_database(args):
+    import lib.bh_utils as bh_utils
+    import lib.utils as utils
+
     NEED_RESTART = False
     # check if bloodhound is up
     if utils.check_is_up():
@@ -120,32 +249,41 @@ if args.set_database:
     if NEED_RESTART:
         print("Starting containers...")
         utils.start_containers()
-        # wait for 10 seconds
-        time.sleep(10)
+        _wait_ready(args)
 
         # clear the inject / upload history
         if bh_utils.verify_access():
             utils.clear_inject_history()
     print(f"Database set to: {new_db}")
 
+
 # retrieve initial password
-if args.retrieve_initial_password:
+def cmd_retrieve_initial_password(args):
+    import lib.utils as utils
+
     initial_password = utils.retrieve_initial_password()
     print(f"Initial password: {initial_password}")
 
+
 # change password
-if args.change_password:
+def cmd_change_password(args):
+    import lib.config as config
+    import lib.utils as utils
+
     new_password = utils.change_password_api()
     if new_password != "Failed to change password":
-        config.update_env_variables("BHE_PASSWORD", new_password)
-        config.update_env_variables("BHE_NEW_PASSWORD", "none")
-        config.update_env_variables("MUST_CHANGE_PASSWORD", "no")
+        config.update_env_variables_batch(
+            {"BHE_PASSWORD": new_password, "BHE_NEW_PASSWORD": "none", "MUST_CHANGE_PASSWORD": "no"}
+        )
         print(f"Password changed to: {new_password}")
     else:
         print("Failed to change password")
 
+
 # create api key
-if args.create_api_key:
+def cmd_create_api_key(args):
+    import lib.utils as utils
+
     api_key = utils.create_api_key()
     data = {
         "id": api_key["id"],
@@ -159,22 +297,35 @@ if args.create_api_key:
         utils.update_env_api_key(api_key)
         print("API key updated in .env")
 
+
 # initial configuration
-if args.initial_config:
+def cmd_initial_config(args):
+    import auth_flow
+
     # run the auth flow
     auth_flow.authenticate()
     print("Initial configuration complete")
 
+
 # import specterops queries
-if args.import_specterops_queries:
-    specterops_queries = queries.load_specterops_queries()
-    queries.import_queries(specterops_queries)
+def cmd_import_specterops_queries(args):
+    import lib.queries as queries
+
+    try:
+        specterops_queries = queries.load_specterops_queries(args.offline or None)
+    except ValueError as exc:
+        print(exc)
+        sys.exit(1)
+    queries.import_queries(specterops_queries, args.workers)
     print("SpecterOps queries imported")
 
+
 # import custom queries
-if args.import_custom_queries:
+def cmd_import_custom_queries(args):
+    import lib.queries as queries
+
     try:
-        custom_queries = queries.load_custom_queries(args.import_custom_queries)
+        custom_queries = queries.load_custom_queries(args.import_custom_queries, args.offline or None)
     except ValueError as exc:
         print(exc)
         sys.exit(1)
@@ -190,13 +341,16 @@ if args.import_custom_queries:
         custom_queries = queries.convert_legacy_queries(queries_list)
         print("Legacy queries converted")
 
-    queries.import_queries(custom_queries)
+    queries.import_queries(custom_queries, args.workers)
     print("Custom queries imported")
 
+
 # import custom node icons
-if args.import_custom_icons:
+def cmd_import_custom_icons(args):
+    import lib.queries as queries
+
     try:
-        custom_icons = queries.load_custom_icons(args.import_custom_icons)
+        custom_icons = queries.load_custom_icons(args.import_custom_icons, args.offline or None)
     except ValueError as exc:
         print(exc)
         sys.exit(1)
@@ -206,25 +360,283 @@ if args.import_custom_icons:
     else:
         sys.exit(1)
 
+
 # delete all custom queries
-if args.delete_all_queries:
-    queries.delete_all_saved_queries()
-    print("All custom queries deleted")
+def cmd_delete_all_queries(args):
+    import lib.queries as queries
+
+    queries.delete_saved_queries(args.name_prefix, args.owner, args.scope, args.workers)
+    print("Custom queries deleted")
+
+
+# validate a collection and write its manifest
+def cmd_validate_collection(args):
+    import lib.validator as validator
+
+    try:
+        manifest = validator.validate_collection(args.validate_collection)
+    except ValueError as exc:
+        print(exc)
+        sys.exit(1)
+    validator.print_report(manifest)
+    print(f"Manifest written to {validator.write_manifest(manifest)}")
+    if not manifest["ok"]:
+        sys.exit(1)
+
+
+# upload only the objects that changed since the last delta upload
+def _upload_delta(args):
+    import lib.delta as delta
+    import lib.upload_index as upload_index
+    import lib.utils as utils
+
+    snapshot = delta.Snapshot()
+    output_dir = delta.delta_dir(args.upload_collection)
+    try:
+        try:
+            stats = delta.build_delta(args.upload_collection, output_dir, snapshot)
+        except ValueError as exc:
+            print(exc)
+            snapshot.discard_pending()
+            sys.exit(1)
+        print(
+            f"Delta: {stats['new']} new, {stats['changed']} changed, {stats['unchanged']} unchanged "
+            f"of {stats['objects']} objects"
+        )
+        if not stats["files"]:
+            print("Nothing changed since the last delta upload")
+            return
+
+        index = upload_index.UploadIndex()
+        try:
+            upload_result = utils.upload_file_process(
+                None, output_dir, False, args.workers, None, args.split_size * 1024 * 1024, None, index
+            )
+            upload_id = upload_result["upload_id"]
+            status = "failed"
+            if upload_id is not None:
+                status = utils.wait_for_upload_complete(upload_id, upload_result["bytes"] or None)
+                utils.confirm_upload_index(index, upload_id, status)
+        finally:
+            index.close()
+        # the snapshot only moves forward when every object was sent and ingested, the server completes
+        # a job with whatever it received, so a file that failed to upload would never be sent again
+        failed = upload_result["error"] or upload_result["failed"]
+        if status == "complete" and not failed:
+            snapshot.commit_pending()
+        else:
+            snapshot.discard_pending()
+        if failed or status != "complete":
+            print("[-] Delta upload incomplete, the snapshot was not updated")
+            sys.exit(1)
+    finally:
+        delta.remove_delta_dir(output_dir)
+        snapshot.close()
+
 
 # upload collection
-if args.upload_collection:
-    new_upload = utils.initialize_upload()
-    upload_status = utils.get_latest_upload_data()
-    upload_id = upload_status["id"]
-    utils.upload_file_process(upload_id, args.upload_collection)
-    utils.wait_for_upload_complete()
+def cmd_upload_collection(args):
+    import lib.batch as batch
+
+    if args.delta:
+        _upload_delta(args)
+        return
+
+    # same pipeline as a single collection of -buc: validation / manifest, journal, upload index, tracking
+    summary = batch.run_collection(
+        args.upload_collection,
+        args.zip_upload,
+        args.workers,
+        args.resume,
+        args.split_size * 1024 * 1024,
+        args.validate,
+        args.skip_unchanged,
+    )
+    if summary["status"] == "already uploaded":
+        print(f"All the files of {args.upload_collection} were already uploaded")
+    elif summary["status"] == "unchanged":
+        print(f"Nothing to upload, every file of {args.upload_collection} was skipped")
+    # failed files or ingest exit non zero, so scripts and --instances see the failure
+    if summary["error"]:
+        print(f"[-] {summary['error']}")
+        sys.exit(1)
+    if summary["status"] == "failed":
+        sys.exit(1)
+
+
+# batch upload collections
+def cmd_batch_upload(args):
+    import lib.batch as batch
+
+    collection_paths = batch.resolve_collections(args.batch_upload)
+    if not collection_paths:
+        print(f"No collection found for: {args.batch_upload}")
+        sys.exit(1)
+    print(f"Uploading {len(collection_paths)} collections with {args.jobs} jobs in flight")
+    summaries = batch.run_batch(
+        collection_paths,
+        args.jobs,
+        args.zip_upload,
+        args.workers,
+        args.resume,
+        args.split_size * 1024 * 1024,
+        args.validate,
+        args.skip_unchanged,
+    )
+    batch.print_summary(summaries)
+    summary_path = batch.write_summary(summaries, args.summary)
+    print(f"Batch summary written to {summary_path}")
+    if any(summary["error"] or summary["status"] == "failed" for summary in summaries):
+        sys.exit(1)
+
 
 # run analysis
-if args.run_analysis:
+def cmd_run_analysis(args):
+    import lib.utils as utils
+
+    if args.wait_analysis:
+        # cmd_wait_analysis leaves it to us, the analysis must be waited for from before it starts
+        _wait_analysis(args, start_analysis=True)
+        return
     utils.run_analysis()
     print("Analysis Lauched")
 
+
+def _wait_analysis(args, start_analysis=False):
+    import lib.datapipe as datapipe
+
+    result = datapipe.wait_for_analysis(args.analysis_timeout, start_analysis)
+    phases = ", ".join(f"{phase} {seconds}s" for phase, seconds in result["phases"].items()) or "nothing to do"
+    print(f"Datapipe {result['status']} after {result['elapsed']}s ({phases})")
+    if result["status"] != datapipe.IDLE:
+        sys.exit(1)
+
+
+# wait for ingest / analysis to finish
+def cmd_wait_analysis(args):
+    if not args.run_analysis:
+        _wait_analysis(args)
+
+
 # set all saved queries permissions to public
-if args.set_queries_public:
-    queries.set_queries_permissions(True, None)
-    print("All queries permissions set to public")
+def cmd_set_queries_public(args):
+    import lib.queries as queries
+
+    queries.set_queries_permissions(True, None, args.name_prefix, args.owner, args.scope, args.workers)
+    print("Queries permissions set to public")
+
+
+# (argument dest, handler), run in this order
+COMMANDS = [
+    ("start_containers", cmd_start_containers),
+    ("stop_containers", cmd_stop_containers),
+    ("restart_containers", cmd_restart_containers),
+    ("docker_logs", cmd_docker_logs),
+    ("verify_access", cmd_verify_access),
+    ("list_databases", cmd_list_databases),
+    ("current_db", cmd_current_db),
+    ("set_database", cmd_set_database),
+    ("retrieve_initial_password", cmd_retrieve_initial_password),
+    ("change_password", cmd_change_password),
+    ("create_api_key", cmd_create_api_key),
+    ("initial_config", cmd_initial_config),
+    ("import_specterops_queries", cmd_import_specterops_queries),
+    ("import_custom_queries", cmd_import_custom_queries),
+    ("import_custom_icons", cmd_import_custom_icons),
+    ("delete_all_queries", cmd_delete_all_queries),
+    ("validate_collection", cmd_validate_collection),
+    ("upload_collection", cmd_upload_collection),
+    ("batch_upload", cmd_batch_upload),
+    ("run_analysis", cmd_run_analysis),
+    ("wait_analysis", cmd_wait_analysis),
+    ("set_queries_public", cmd_set_queries_public),
+]
+
+# commands that only read local state, the banner is skipped when only these run
+LOCAL_COMMANDS = {"list_databases", "current_db", "validate_collection"}
+
+# API-only commands that can run against several instances (--instances)
+FANOUT_COMMANDS = {
+    "verify_access",
+    "import_specterops_queries",
+    "import_custom_queries",
+    "import_custom_icons",
+    "delete_all_queries",
+    "upload_collection",
+    "batch_upload",
+    "run_analysis",
+    "wait_analysis",
+    "set_queries_public",
+}
+
+
+# run the selected commands once per instance profile
+def run_fanout(args, selected):
+    import lib.instances as instances
+
+    not_supported = [dest for dest, _ in selected if dest not in FANOUT_COMMANDS]
+    if not_supported:
+        print(f"Not supported with --instances: {', '.join(not_supported)}")
+        sys.exit(1)
+
+    only = [name.strip() for name in args.only.split(",") if name.strip()] if args.only else None
+    try:
+        profiles = instances.load_profiles(args.instances, only)
+    except ValueError as exc:
+        print(exc)
+        sys.exit(1)
+
+    def operation(name):
+        for _, handler in selected:
+            handler(args)
+
+    print(f"Running on {len(profiles)} instances, {args.max_parallel} at once")
+    results = instances.run_on_instances(operation, profiles, args.max_parallel, args.workers)
+    instances.print_results(results)
+    if not all(result["ok"] for result in results):
+        sys.exit(1)
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    # if no arguments, print help
+    if len(argv) == 0:
+        parser.print_help()
+        sys.exit(1)
+
+    selected = [(dest, handler) for dest, handler in COMMANDS if getattr(args, dest)]
+
+    # if no banner or local-only commands, don't show banner
+    if not args.no_banner and any(dest not in LOCAL_COMMANDS for dest, _ in selected):
+        import lib.banner as banner
+
+        banner.generate_banner()
+
+    if args.gzip:
+        import lib.compression as compression
+
+        compression.configure(enabled=True)
+
+    if args.instances:
+        run_fanout(args, selected)
+    else:
+        for _, handler in selected:
+            handler(args)
+
+    if args.gzip:
+        compression_stats = compression.stats()
+        if compression_stats["bodies"]:
+            ratio = compression_stats["bytes_in"] / max(1, compression_stats["bytes_out"])
+            print(
+                f"gzip: {compression_stats['bodies']} bodies, {compression_stats['bytes_in']} bytes sent as "
+                f"{compression_stats['bytes_out']} ({ratio:.1f}x)"
+                + (f", refused {compression_stats['fallbacks']} times" if compression_stats["fallbacks"] else "")
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+import asyncio
+import base64
+import json
+import os
+from urllib.parse import quote
+import aiohttp
+import lib.config as config
+import lib.http_client as http_client
+import lib.rate_limit as rate_limit
+import lib.signer as signer
+
+# asyncio client for the BloodHound API
+# mirrors bh_utils.pass_request and the saved queries / file upload / analysis helpers, sharing the
+# request signing (lib.signer) and the per host adaptive rate limiter (lib.rate_limit) with the sync code.
+#
+# async with AsyncBloodHoundClient() as client:
+#     await client.pass_request("GET", "/api/v2/self")
+
+DEFAULT_CONCURRENCY = 20
+DEFAULT_TIMEOUT = 300
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_THROTTLE_RETRIES = 5
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+class AsyncResponse(object):
+    """
+    Response of the async client, with the parts of requests.Response the toolkit uses
+    """
+
+    def __init__(self, status_code: int, headers, content: bytes) -> None:
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def _hash_file(digester, file_path):
+    with open(file_path, "rb") as file_obj:
+        for chunk in iter(lambda: file_obj.read(STREAM_CHUNK_SIZE), b""):
+            digester.update(chunk)
+    return os.path.getsize(file_path)
+
+
+class AsyncBloodHoundClient(object):
+    def __init__(
+        self,
+        base_url: str = None,
+        token_id: str = None,
+        token_key: str = None,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        timeout: float = DEFAULT_TIMEOUT,
+    ) -> None:
+        current_env = config.load_env_variables()
+        self.base_url = base_url or current_env["build_url"]
+        self.signer = signer.get_signer(token_id or current_env["token_id"], token_key or current_env["token_key"])
+        self.limiter = rate_limit.get_limiter(self.base_url)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.close()
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={"User-Agent": http_client.USER_AGENT},
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _acquire(self):
+        while True:
+            wait = self.limiter.try_acquire()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    async def _send(self, method, endpoint, datetime_formatted, signature, content_type, data, extra_headers=None):
+        headers = {
+            "Authorization": f"bhesignature {self.signer.token_id}",
+            "RequestDate": datetime_formatted,
+            "Signature": signature.decode(),
+            "Content-Type": content_type,
+        }
+        headers.update(extra_headers or {})
+        async with self._get_session().request(method, self.base_url + endpoint, headers=headers, data=data) as resp:
+            return AsyncResponse(resp.status, resp.headers, await resp.read())
+
+    async def _request(self, method, endpoint, build_body, datetime_formatted, signature, content_type, extra_headers):
+        # build_body() returns a fresh body for every attempt, streamed bodies can't be sent twice
+        async with self._semaphore:
+            for attempt in range(DEFAULT_THROTTLE_RETRIES + 1):
+                await self._acquire()
+                response = await self._send(
+                    method, endpoint, datetime_formatted, signature, content_type, build_body(), extra_headers
+                )
+                if response.status_code != 429:
+                    self.limiter.on_success()
+                    return response
+                self.limiter.on_throttle(rate_limit.parse_retry_after(response.headers.get("Retry-After")))
+            return response
+
+    async def pass_request(self, method, endpoint, body=None, content_type="application/json"):
+        """
+        Signed request, body can be a dict / list (sent as json) or bytes
+        """
+        if body is not None and not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        datetime_formatted, signature = self.signer.sign(method, endpoint, body)
+        return await self._request(method, endpoint, lambda: body, datetime_formatted, signature, content_type, None)
+
+    async def pass_request_file(self, method, endpoint, file_path, content_type="application/json"):
+        """
+        Signed request streaming the body from a file, hashed in a worker thread first
+        """
+        datetime_formatted, digester = self.signer.body_digester(method, endpoint)
+        length = await asyncio.to_thread(_hash_file, digester, file_path)
+        signature = base64.b64encode(digester.digest())
+
+        opened_files = []
+
+        def build_body():
+            file_obj = open(file_path, "rb")
+            opened_files.append(file_obj)
+            return file_obj
+
+        try:
+            return await self._request(
+                method,
+                endpoint,
+                build_body,
+                datetime_formatted,
+                signature,
+                content_type,
+                {"Content-Length": str(length)},
+            )
+        finally:
+            for file_obj in opened_files:
+                file_obj.close()
+
+    # saved queries
+
+    async def iter_saved_queries(self, page_size=DEFAULT_PAGE_SIZE, scope=None):
+        skip = 0
+        while True:
+            # stable order, skip / limit pages would overlap or shift otherwise
+            endpoint = f"/api/v2/saved-queries?skip={skip}&limit={page_size}&sort_by=id"
+            if scope is not None:
+                endpoint += f"&scope={quote(scope, safe=',')}"
+            response = await self.pass_request("GET", endpoint)
+            if response.status_code != 200:
+                raise ValueError(f"Failed to list saved queries (HTTP {response.status_code}): {response.text}")
+            payload = response.json()
+            page = payload.get("data") or []
+            for saved_query in page:
+                yield saved_query
+            skip += len(page)
+            count = payload.get("count")
+            if len(page) < page_size or (count is not None and skip >= count):
+                return
+
+    async def get_saved_queries(self, page_size=DEFAULT_PAGE_SIZE, scope=None):
+        return [saved_query async for saved_query in self.iter_saved_queries(page_size, scope)]
+
+    async def create_saved_query(self, query):
+        return await self.pass_request("POST", "/api/v2/saved-queries", query)
+
+    async def update_saved_query(self, query_id, query):
+        payload = {"name": query.get("name"), "query": query.get("query"), "description": query.get("description", "")}
+        return await self.pass_request("PUT", f"/api/v2/saved-queries/{query_id}", payload)
+
+    async def delete_saved_query(self, query_id):
+        return await self.pass_request("DELETE", f"/api/v2/saved-queries/{query_id}")
+
+    async def set_saved_query_permissions(self, query_id, public=True, users=None):
+        payload = {"public": public, "user_ids": users or []}
+        return await self.pass_request("PUT", f"/api/v2/saved-queries/{query_id}/permissions", payload)
+
+    # file upload
+
+    async def start_upload(self):
+        response = await self.pass_request("POST", "/api/v2/file-upload/start", {})
+        if response.status_code != 201:
+            raise ValueError(f"Failed to initialize upload (HTTP {response.status_code}): {response.text}")
+        return response.json()["data"]
+
+    async def upload_file(self, upload_id, file_path, content_type="application/json"):
+        return await self.pass_request_file("POST", f"/api/v2/file-upload/{upload_id}", file_path, content_type)
+
+    async def upload_data(self, upload_id, data, content_type="application/json"):
+        return await self.pass_request("POST", f"/api/v2/file-upload/{upload_id}", data, content_type)
+
+    async def end_upload(self, upload_id):
+        return await self.pass_request("POST", f"/api/v2/file-upload/{upload_id}/end", {})
+
+    async def get_upload(self, upload_id):
+        response = await self.pass_request("GET", f"/api/v2/file-upload?skip=0&limit=1&id=eq:{upload_id}")
+        if response.status_code != 200:
+            raise ValueError(f"Failed to get upload status (HTTP {response.status_code}): {response.text}")
+        data = response.json()["data"]
+        return data[0] if data else None
+
+    # analysis / datapipe
+
+    async def run_analysis(self):
+        return await self.pass_request("PUT", "/api/v2/analysis", {})
+
+    async def datapipe_status(self):
+        response = await self.pass_request("GET", "/api/v2/datapipe/status")
+        if response.status_code != 200:
+            raise ValueError(f"Failed to get datapipe status (HTTP {response.status_code}): {response.text}")
+        return response.json()
@@ -1,7 +1,7 @@
-from art import *
-
-
 def generate_banner():
+    # art loads its font tables on import, only pay for it when the banner is shown
+    from art import text2art
+
     # added "powered by Yack" to the bottom of the art
     Art = text2art("Hacking for Good", "random")
     # get the wide of the art
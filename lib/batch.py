@@ -0,0 +1,195 @@
+import datetime
+import glob
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import lib.bulk as bulk
+import lib.collection as collection
+import lib.http_client as http_client
+import lib.journal as journal
+import lib.upload_index as upload_index
+import lib.uploader as uploader
+import lib.validator as validator
+import lib.utils as utils
+
+# batch upload of many collections in one run
+# collections are queued and at most `jobs` upload jobs are in flight. every job is tracked
+# by its own upload id, so concurrent ingests don't get mixed up.
+
+DEFAULT_JOBS = 2
+
+_print_lock = threading.Lock()
+
+
+def _log(message):
+    with _print_lock:
+        print(message)
+
+
+def resolve_collections(spec):
+    """
+    Return the collection paths matching a glob pattern, or listed in a manifest.
+    A manifest is a .json file (list of paths, or list of {"path": ...}) or a text file with one path per line.
+    Relative paths in a manifest are relative to the manifest location.
+    """
+    if os.path.isfile(spec) and not collection.is_zip_collection(spec):
+        manifest_dir = os.path.dirname(os.path.abspath(spec))
+        with open(spec, "r") as file:
+            if spec.lower().endswith(".json"):
+                entries = json.load(file)
+                paths = [entry["path"] if isinstance(entry, dict) else entry for entry in entries]
+            else:
+                paths = [line.strip() for line in file if line.strip() and not line.strip().startswith("#")]
+        return [os.path.join(manifest_dir, os.path.expanduser(path)) for path in paths]
+    return sorted(
+        path
+        for path in glob.glob(os.path.expanduser(spec))
+        if os.path.isdir(path) or collection.is_zip_collection(path)
+    )
+
+
+def run_collection(
+    data_path,
+    send_zip=False,
+    workers=uploader.DEFAULT_WORKERS,
+    resume=False,
+    split_size=None,
+    validate=False,
+    skip_unchanged=False,
+):
+    """
+    Upload one collection in its own upload job and wait for the ingest to finish.
+    With resume, files accepted by a previous run (upload journal) are skipped.
+    With validate, the collection is validated first (lib.validator) and invalid files are left out,
+    otherwise the manifest of a previous validation is used when it is still current.
+    With skip_unchanged, files already ingested into the current database (lib.upload_index) are skipped.
+    Return the summary of the collection, "error" is set when something was not uploaded.
+    """
+    started = time.monotonic()
+    summary = {
+        "collection": data_path,
+        "upload_id": None,
+        "status": "failed",
+        "files": 0,
+        "skipped": 0,
+        "unchanged": 0,
+        "bytes": 0,
+        "bytes_saved": 0,
+        "error": None,
+    }
+    index = None
+    try:
+        manifest = None
+        if not (send_zip and collection.is_zip_collection(data_path)):
+            if validate:
+                manifest = validator.validate_collection(data_path)
+                validator.write_manifest(manifest)
+                invalid = [entry["name"] for entry in manifest["files"] if entry["errors"]]
+                if invalid:
+                    _log(f"[-] {data_path}: invalid files {', '.join(invalid)}")
+                if len(invalid) == len(manifest["files"]):
+                    summary["error"] = "No valid file to upload"
+                    return summary
+            else:
+                manifest = validator.load_manifest(data_path)
+
+        upload_journal = journal.UploadJournal(data_path)
+        if not resume:
+            upload_journal.reset()
+        elif upload_journal.is_complete(collection.sent_files(data_path, send_zip)):
+            summary["status"] = "already uploaded"
+            return summary
+        # sha256 of the ingested files, to skip them next time (skip_unchanged)
+        index = upload_index.UploadIndex()
+        _log(f"Uploading {data_path}")
+
+        # the upload job is only started once there is something to send
+        upload_result = utils.upload_file_process(
+            None, data_path, send_zip, workers, upload_journal, split_size, manifest, index, skip_unchanged
+        )
+        upload_id = upload_result["upload_id"]
+        summary["upload_id"] = upload_id
+        summary["files"] = len(upload_result["uploaded"])
+        summary["skipped"] = len(upload_result["skipped"])
+        summary["unchanged"] = len(upload_result["unchanged"])
+        summary["bytes"] = upload_result["bytes"]
+        summary["bytes_saved"] = upload_result["bytes_saved"]
+        if upload_result["error"]:
+            summary["error"] = upload_result["error"]
+        elif upload_result["failed"]:
+            summary["error"] = f"{len(upload_result['failed'])} files failed to upload"
+
+        if upload_id is None:
+            # nothing was sent, there is no job to track
+            if summary["error"] is None:
+                summary["status"] = "unchanged"
+            return summary
+        # throughput only counts the bytes sent by this run
+        summary["status"] = utils.wait_for_upload_complete(upload_id, summary["bytes"] or None)
+        utils.confirm_upload_index(index, upload_id, summary["status"])
+    except Exception as exc:
+        summary["error"] = f"{type(exc).__name__}: {exc}"
+    finally:
+        if index is not None:
+            index.close()
+        summary["duration"] = round(time.monotonic() - started, 2)
+    return summary
+
+
+def run_batch(
+    collection_paths,
+    jobs=DEFAULT_JOBS,
+    send_zip=False,
+    workers=uploader.DEFAULT_WORKERS,
+    resume=False,
+    split_size=None,
+    validate=False,
+    skip_unchanged=False,
+):
+    """
+    Upload every collection, keeping at most `jobs` upload jobs in flight.
+    With resume, every collection skips the files its upload journal lists as accepted.
+    Return the summaries in the order of collection_paths.
+    """
+    summaries = {}
+    http_client.ensure_pool_size(max(1, jobs) * max(1, workers))
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = {
+            bulk.submit(
+                executor, run_collection, data_path, send_zip, workers, resume, split_size, validate, skip_unchanged
+            ): index
+            for index, data_path in enumerate(collection_paths)
+        }
+        for future in as_completed(futures):
+            summary = future.result()
+            summaries[futures[future]] = summary
+            _log(f"[{summary['upload_id']}] {summary['collection']}: {summary['status']}")
+    return [summaries[index] for index in range(len(collection_paths))]
+
+
+def print_summary(summaries):
+    print("")
+    print(f"{'upload id':<10} {'status':<20} {'files':>6} {'bytes':>14} {'time (s)':>9}  collection")
+    for summary in summaries:
+        print(
+            f"{str(summary['upload_id']):<10} {summary['status']:<20} {summary['files']:>6} "
+            f"{summary['bytes']:>14} {summary['duration']:>9}  {summary['collection']}"
+        )
+        if summary["unchanged"]:
+            print(f"{'':<10} {summary['unchanged']} unchanged files skipped, {summary['bytes_saved']} bytes saved")
+        if summary["error"]:
+            print(f"{'':<10} error: {summary['error']}")
+
+
+def write_summary(summaries, summary_path=None):
+    if summary_path is None:
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        summary_path = os.path.join(os.getcwd(), "data", f"batch_summary_{timestamp}.json")
+    summary_dir = os.path.dirname(summary_path)
+    if summary_dir and not os.path.exists(summary_dir):
+        os.makedirs(summary_dir)
+    with open(summary_path, "w") as file:
+        json.dump(summaries, file, indent=2)
+    return summary_path
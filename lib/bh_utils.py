@@ -1,11 +1,11 @@
-import datetime
-import hashlib
-import hmac
 import base64
 import requests
 from typing import Optional
+import lib.compression as compression
 import lib.config as config
-import lib.utils as utils
+import lib.http_client as http_client
+import lib.health as health
+import lib.signer as signer
 import json
 import sys
 
@@ -13,9 +13,10 @@ do_proxy = False
 proxy_url = "http://127.0.0.1:8181"
 
 # https://bloodhound.specterops.io/integrations/bloodhound-api/working-with-api
+# the signature chain itself lives in lib/signer.py
 
-# load env variables
-env = config.load_env_variables()
+# read size used when signing and sending file bodies
+STREAM_CHUNK_SIZE = 1024 * 1024
 
 
 class Credentials(object):
@@ -24,80 +25,126 @@ class Credentials(object):
         self.token_key = token_key
 
 
-def _request(method: str, path: str, full_url: str = None, body: Optional[bytes] = None) -> requests.Response:
-    # check if bloodhound is up
-    if utils.check_is_up() is False:
+class StreamBody(object):
+    """
+    Request body read from a binary file object in chunks.
+    Exposing __len__ makes requests send a Content-Length instead of chunked transfer encoding.
+    """
+
+    def __init__(self, file_obj, length: int, chunk_size: int = STREAM_CHUNK_SIZE) -> None:
+        self.file_obj = file_obj
+        self.length = length
+        self.chunk_size = chunk_size
+        self.start = file_obj.tell()
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self):
+        # rewind so the body can be sent again when the request is retried (429)
+        self.file_obj.seek(self.start)
+        while True:
+            chunk = self.file_obj.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _stream_length(file_obj) -> int:
+    start = file_obj.tell()
+    file_obj.seek(0, 2)
+    length = file_obj.tell() - start
+    file_obj.seek(start)
+    return length
+
+
+def _request(
+    method: str,
+    path: str,
+    full_url: str = None,
+    body=None,
+    content_type: str = "application/json",
+    body_length: Optional[int] = None,
+    content_encoding: Optional[str] = None,
+) -> requests.Response:
+    # check if bloodhound is up, the probe result is cached between calls
+    if health.state.is_up() is False:
         print("BH is not running, you need to start it first!")
         sys.exit(1)
 
     # Reload env variables to get the latest token values
     current_env = config.load_env_variables()
-    credentials = Credentials(current_env["token_id"], current_env["token_key"])
-    # Digester is initialized with HMAC-SHA-256 using the token key as the HMAC digest key.
-    digester = hmac.new(credentials.token_key.encode(), None, hashlib.sha256)
-
-    # OperationKey is the first HMAC digest link in the signature chain. This prevents replay attacks that seek to
-    # modify the request method or URI. It is composed of concatenating the request method and the request URI with
-    # no delimiter and computing the HMAC digest using the token key as the digest secret.
-    #
-    # Example: GET /api/v2/test/resource HTTP/1.1
-    # Signature Component: GET/api/v2/test/resource
-    digester.update(f"{method}{path}".encode())
-
-    # Update the digester for further chaining
-    digester = hmac.new(digester.digest(), None, hashlib.sha256)
-
-    # DateKey is the next HMAC digest link in the signature chain. This encodes the RFC3339 formatted datetime
-    # value as part of the signature to the hour to prevent replay attacks that are older than max two hours. This
-    # value is added to the signature chain by cutting off all values from the RFC3339 formatted datetime from the
-    # hours value forward:
-    #
-    # Example: 2020-12-01T23:59:60Z
-    # Signature Component: 2020-12-01T23
-    datetime_formatted = datetime.datetime.now().astimezone().isoformat("T")
-    digester.update(datetime_formatted[:13].encode())
-
-    # Update the digester for further chaining
-    digester = hmac.new(digester.digest(), None, hashlib.sha256)
-
-    # Body signing is the last HMAC digest link in the signature chain. This encodes the request body as part of
-    # the signature to prevent replay attacks that seek to modify the payload of a signed request. In the case
-    # where there is no body content the HMAC digest is computed anyway, simply with no values written to the
-    # digester.
-    if body is not None:
+    # the signer caches the method + path and date links of the HMAC chain, only the body is hashed here
+    request_signer = signer.get_signer(current_env["token_id"], current_env["token_key"])
+    datetime_formatted, digester = request_signer.body_digester(method, path)
+
+    # File bodies are hashed chunk by chunk and rewound, so the payload is never held in memory. The signature
+    # header has to be sent before the body, hence the separate hashing pass.
+    if hasattr(body, "read"):
+        start = body.tell()
+        if body_length is None:
+            body_length = _stream_length(body)
+        for chunk in iter(lambda: body.read(STREAM_CHUNK_SIZE), b""):
+            digester.update(chunk)
+        body.seek(start)
+        body = StreamBody(body, body_length)
+    elif body is not None:
         digester.update(body)
 
-    if do_proxy:
-        response = requests.request(
-            method=method,
-            url=full_url or path,
-            headers={
-                "User-Agent": "bhe-python-sdk 0001",
-                "Authorization": f"bhesignature {credentials.token_id}",
-                "RequestDate": datetime_formatted,
-                "Signature": base64.b64encode(digester.digest()),
-                "Content-Type": "application/json",
-            },
-            data=body,
-            proxies={"http": proxy_url, "https": proxy_url},
-        )
-    else:
-        response = requests.request(
-            method=method,
-            url=full_url or path,
-            headers={
-                "User-Agent": "bhe-python-sdk 0001",
-                "Authorization": f"bhesignature {credentials.token_id}",
-                "RequestDate": datetime_formatted,
-                "Signature": base64.b64encode(digester.digest()),
-                "Content-Type": "application/json",
-            },
+    headers = {
+        "User-Agent": http_client.USER_AGENT,
+        "Authorization": f"bhesignature {request_signer.token_id}",
+        "RequestDate": datetime_formatted,
+        "Signature": base64.b64encode(digester.digest()),
+        "Content-Type": content_type,
+    }
+    if content_encoding:
+        headers["Content-Encoding"] = content_encoding
+
+    proxies = {"http": proxy_url, "https": proxy_url} if do_proxy else None
+    try:
+        response = http_client.request(
+            method,
+            full_url or path,
+            headers=headers,
             data=body,
+            proxies=proxies,
         )
+    except requests.exceptions.ConnectionError:
+        # force a new probe on the next call
+        health.state.invalidate()
+        raise
+    health.state.mark_up()
     return response
 
 
-def pass_request(method, endpoint, body=None):
+def _request_gzip(method, path, full_url, body, content_type, body_length):
+    # the signature covers the compressed bytes, the plain body is sent again if the server refuses gzip
+    if hasattr(body, "read"):
+        start = body.tell()
+        compressed, compressed_length = compression.gzip_file(body)
+    else:
+        compressed = compression.gzip_bytes(body)
+        compressed_length = len(compressed)
+    try:
+        response = _request(method, path, full_url, compressed, content_type, compressed_length, "gzip")
+    finally:
+        if hasattr(compressed, "close"):
+            compressed.close()
+    if not compression.is_rejected(response):
+        return response
+
+    print(f"[!] gzip body refused (HTTP {response.status_code}), sending uncompressed bodies from now on")
+    compression.mark_rejected()
+    if hasattr(body, "read"):
+        body.seek(start)
+    return _request(method, path, full_url, body, content_type, body_length)
+
+
+def pass_request(method, endpoint, body=None, compress=False):
+    """
+    Signed request, with compress the body is sent gzip encoded when gzip is enabled (lib.compression)
+    """
     current_env = config.load_env_variables()
     full_url = current_env["build_url"] + endpoint
     path = endpoint
@@ -106,10 +153,23 @@ def pass_request(method, endpoint, body=None):
     if body is not None and not isinstance(body, bytes):
         body = json.dumps(body).encode("utf-8")
 
+    if compress and body is not None and compression.should_compress(len(body)):
+        return _request_gzip(method, path, full_url, body, "application/json", None)
     response = _request(method, path, full_url, body)
     return response
 
 
+def pass_request_stream(method, endpoint, file_obj, content_type="application/json", length=None, compress=False):
+    """
+    Same as pass_request but the body is streamed from a binary file object (from its current position)
+    """
+    current_env = config.load_env_variables()
+    full_url = current_env["build_url"] + endpoint
+    if compress and compression.should_compress(length):
+        return _request_gzip(method, endpoint, full_url, file_obj, content_type, length)
+    return _request(method, endpoint, full_url, file_obj, content_type, length)
+
+
 def verify_access():
     current_env = config.load_env_variables()
     full_url = current_env["build_url"] + "/api/v2/self"
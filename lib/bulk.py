@@ -0,0 +1,50 @@
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import lib.http_client as http_client
+
+# bounded concurrent execution of API calls
+
+DEFAULT_WORKERS = 4
+
+
+def submit(executor, func, *args):
+    """
+    executor.submit() running func in a copy of the caller's context, so worker threads
+    see the same active instance profile (lib.config.use_config)
+    """
+    return executor.submit(contextvars.copy_context().run, func, *args)
+
+
+def run_concurrent(func, items, workers=DEFAULT_WORKERS):
+    """
+    Call func(item) for every item with at most `workers` calls in flight.
+    items can be a lazy iterator, it is consumed as workers free up.
+    Yield (item, result, error) as the calls finish, error is None on success.
+    """
+    workers = max(1, workers)
+    http_client.ensure_pool_size(workers)
+
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+
+        def submit_next():
+            for item in items:
+                pending[submit(executor, func, item)] = item
+                return True
+            return False
+
+        # keep the queue shallow so a lazy iterator isn't drained upfront
+        for _ in range(workers * 2):
+            if not submit_next():
+                break
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                try:
+                    yield item, future.result(), None
+                except Exception as exc:
+                    yield item, None, exc
+                submit_next()
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import requests
+import lib.http_client as http_client
+
+# on-disk cache for json downloaded from urls (SpecterOps query library, custom queries / icons)
+# the body is stored with its ETag / Last-Modified, later runs send a conditional request and reuse
+# the cached copy on 304. in offline mode only the cache is used.
+
+DEFAULT_TIMEOUT = 30
+
+
+class CacheMiss(Exception):
+    pass
+
+
+def cache_dir():
+    return os.getenv("BHTK_CACHE_DIR") or os.path.join(os.getcwd(), "data", "cache")
+
+
+def is_offline():
+    return os.getenv("BHTK_OFFLINE", "").lower() == "true"
+
+
+def _cache_paths(url, directory):
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return os.path.join(directory, f"{key}.body"), os.path.join(directory, f"{key}.meta.json")
+
+
+def _read_cache(url, directory):
+    body_path, meta_path = _cache_paths(url, directory)
+    if not os.path.exists(body_path) or not os.path.exists(meta_path):
+        return None, None
+    try:
+        with open(meta_path, "r") as file:
+            meta = json.load(file)
+        with open(body_path, "rb") as file:
+            body = file.read()
+    except (OSError, ValueError):
+        return None, None
+    return body, meta
+
+
+def _write_atomic(path, data):
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(data)
+    os.replace(temp_path, path)
+
+
+def _write_cache(url, directory, body, response):
+    os.makedirs(directory, exist_ok=True)
+    body_path, meta_path = _cache_paths(url, directory)
+    meta = {
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "fetched_at": time.time(),
+    }
+    _write_atomic(body_path, body)
+    _write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+
+
+def fetch_json(url, offline=None, timeout=DEFAULT_TIMEOUT, directory=None):
+    """
+    Download and parse json from url through the cache.
+    Raise requests.RequestException / ValueError when it can't be downloaded or parsed and isn't cached,
+    CacheMiss in offline mode when it isn't cached.
+    """
+    directory = directory or cache_dir()
+    if offline is None:
+        offline = is_offline()
+    cached_body, meta = _read_cache(url, directory)
+
+    if offline:
+        if cached_body is None:
+            raise CacheMiss(f"{url} is not in the cache ({directory}) and offline mode is on")
+        return json.loads(cached_body)
+
+    headers = {}
+    if cached_body is not None:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    try:
+        response = http_client.request("GET", url, timeout=timeout, headers=headers)
+        if response.status_code == 304 and cached_body is not None:
+            return json.loads(cached_body)
+        response.raise_for_status()
+    except requests.RequestException as exc:
+        if cached_body is None:
+            raise
+        print(f"[!] Failed to refresh {url} ({exc}), using cached copy")
+        return json.loads(cached_body)
+
+    body = response.content
+    payload = json.loads(body)
+    # only cache what parsed
+    _write_cache(url, directory, body, response)
+    return payload
@@ -0,0 +1,100 @@
+import os
+import time
+import zipfile
+from contextlib import contextmanager
+
+# collection sources
+# the json files of a collection are read in place, either from the source directory or straight
+# from the members of the zip archive. nothing is extracted or copied to data/temp anymore.
+
+
+class CollectionFile(object):
+    def __init__(self, name: str, size: int, path: str, member: str = None, mtime: float = None) -> None:
+        # name: file name shown to the user / sent to the uploader
+        # path: file on disk, or the zip archive when member is set
+        # mtime: modification time of the file / zip member, tells a rewritten file of the same size apart
+        self.name = name
+        self.size = size
+        self.path = path
+        self.member = member
+        self.mtime = mtime
+
+    @contextmanager
+    def open(self):
+        """
+        Open the file for binary reading. Zip members are decompressed on the fly.
+        """
+        if self.member is None:
+            with open(self.path, "rb") as file_obj:
+                yield file_obj
+        else:
+            # every open uses its own ZipFile handle so several members can be read at the same time
+            with zipfile.ZipFile(self.path, "r") as zip_ref:
+                with zip_ref.open(self.member, "r") as file_obj:
+                    yield file_obj
+
+    def __repr__(self) -> str:
+        return f"CollectionFile({self.name!r}, {self.size})"
+
+
+def is_zip_collection(data_path: str) -> bool:
+    return os.path.isfile(data_path) and data_path.lower().endswith(".zip")
+
+
+def _list_zip_files(zip_path):
+    # the name keys the file in the journal, manifest and delta output: it is the file name, or the member
+    # path when several folders of the archive hold a file of that name (dc1/x_users.json, dc2/x_users.json)
+    members = []
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        for info in zip_ref.infolist():
+            name = os.path.basename(info.filename)
+            if info.is_dir() or info.filename.startswith("__MACOSX/") or not name.lower().endswith(".json"):
+                continue
+            members.append((name, info))
+    name_counts = {}
+    for name, _ in members:
+        name_counts[name] = name_counts.get(name, 0) + 1
+    collection_files = []
+    for name, info in members:
+        if name_counts[name] > 1:
+            name = info.filename
+        mtime = time.mktime(info.date_time + (0, 0, -1))
+        collection_files.append(CollectionFile(name, info.file_size, zip_path, info.filename, mtime))
+    return collection_files
+
+
+def _list_dir_files(dir_path):
+    collection_files = []
+    for file in sorted(os.listdir(dir_path)):
+        file_path = os.path.join(dir_path, file)
+        if file.lower().endswith(".json") and os.path.isfile(file_path):
+            stat = os.stat(file_path)
+            collection_files.append(CollectionFile(file, stat.st_size, file_path, mtime=stat.st_mtime))
+    return collection_files
+
+
+def list_collection_files(data_path: str):
+    """
+    List the json files of a collection (directory or zip archive)
+    """
+    if is_zip_collection(data_path):
+        return _list_zip_files(data_path)
+    if os.path.isdir(data_path):
+        return _list_dir_files(data_path)
+    raise ValueError(f"Collection not found or not a directory / zip file: {data_path}")
+
+
+def sent_files(data_path: str, send_zip: bool = False):
+    """
+    (name, size) of every file sent when uploading the collection
+    """
+    if send_zip and is_zip_collection(data_path):
+        return [(os.path.basename(data_path), os.path.getsize(data_path))]
+    return [(collection_file.name, collection_file.size) for collection_file in list_collection_files(data_path)]
+
+
+def collection_size(data_path: str, send_zip: bool = False) -> int:
+    """
+    Number of bytes sent when uploading the collection
+    """
+    return sum(size for _, size in sent_files(data_path, send_zip))
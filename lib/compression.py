@@ -0,0 +1,97 @@
+import gzip
+import os
+import tempfile
+import threading
+import lib.config as config
+
+# optional gzip content-encoding of request bodies (collection uploads, saved queries imports)
+# bodies are compressed before sending because the bhesignature HMAC has to cover the bytes on the wire
+# and the Signature header goes out before the body. file bodies are compressed chunk by chunk into a
+# spooled temp file (memory up to SPOOL_SIZE, then disk), so large files are never held in memory.
+# an instance answering 415 to a gzip body (or a 400 about its Content-Encoding) is remembered and gets plain
+# bodies from then on. any other 400 is about the body itself and is returned as is.
+
+DEFAULT_LEVEL = 6
+# smaller bodies are sent as is, the gzip header would cost more than it saves
+DEFAULT_MIN_SIZE = 1024
+SPOOL_SIZE = 16 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+REJECTED_STATUS_CODE = 415
+
+_enabled = None
+_level = DEFAULT_LEVEL
+# base urls that don't accept gzip bodies
+_rejected = set()
+_lock = threading.Lock()
+_stats = {"bodies": 0, "bytes_in": 0, "bytes_out": 0, "fallbacks": 0}
+
+
+def configure(enabled: bool = True, level: int = DEFAULT_LEVEL):
+    global _enabled, _level
+    _enabled = enabled
+    _level = level
+
+
+def is_enabled() -> bool:
+    # --gzip (configure) wins over BHTK_GZIP
+    if _enabled is not None:
+        return _enabled
+    return os.getenv("BHTK_GZIP", "").lower() == "true"
+
+
+def should_compress(length) -> bool:
+    if not is_enabled() or (length is not None and length < DEFAULT_MIN_SIZE):
+        return False
+    with _lock:
+        return config.base_url() not in _rejected
+
+
+def is_rejected(response) -> bool:
+    """
+    True when the response refuses the gzip encoding itself, not the content of the body
+    """
+    if response.status_code == REJECTED_STATUS_CODE:
+        return True
+    return response.status_code == 400 and "content-encoding" in (response.text or "").lower()
+
+
+def mark_rejected():
+    with _lock:
+        _rejected.add(config.base_url())
+        _stats["fallbacks"] += 1
+
+
+def _record(bytes_in, bytes_out):
+    with _lock:
+        _stats["bodies"] += 1
+        _stats["bytes_in"] += bytes_in
+        _stats["bytes_out"] += bytes_out
+
+
+def gzip_bytes(body: bytes) -> bytes:
+    compressed = gzip.compress(body, compresslevel=_level)
+    _record(len(body), len(compressed))
+    return compressed
+
+
+def gzip_file(file_obj):
+    """
+    Compress a binary file object from its current position, return (spooled temp file rewound, length).
+    The caller closes the temp file.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    bytes_in = 0
+    # mtime=0 keeps the output identical between runs
+    with gzip.GzipFile(fileobj=spool, mode="wb", compresslevel=_level, mtime=0) as gzip_file_obj:
+        for chunk in iter(lambda: file_obj.read(CHUNK_SIZE), b""):
+            bytes_in += len(chunk)
+            gzip_file_obj.write(chunk)
+    length = spool.tell()
+    spool.seek(0)
+    _record(bytes_in, length)
+    return spool, length
+
+
+def stats() -> dict:
+    with _lock:
+        return dict(_stats)
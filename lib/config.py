@@ -1,65 +1,147 @@
+import contextvars
 import os
+import threading
+from contextlib import contextmanager
 import dotenv
 
 dotenv.load_dotenv()
 
-# load env variables
-# setup base url
+# configuration is read from the environment (and .env) once and cached,
+# updates go through update_env_variables / update_env_variables_batch which invalidate the cache
+
+ENV_FILE_PATH = ".env"
+
+
+class Config(object):
+    def __init__(self, environ=None) -> None:
+        environ = os.environ if environ is None else environ
+        self.base_url: str = environ.get("BHE_DOMAIN")
+        self.base_port: str = environ.get("BHE_PORT")
+        self.base_scheme: str = environ.get("BHE_SCHEME")
+        self.build_url: str = f"{self.base_scheme}://{self.base_url}:{self.base_port}"
+        self.token_id: str = environ.get("BHE_TOKEN_ID")
+        self.token_key: str = environ.get("BHE_TOKEN_KEY")
+        self.username: str = environ.get("BHE_USERNAME")
+        self.must_change_password: str = environ.get("MUST_CHANGE_PASSWORD")
+        self.initial_password: str = environ.get("BHE_INITIAL_PASSWORD")
+        self.password: str = environ.get("BHE_PASSWORD")
+        self.new_password: str = environ.get("BHE_NEW_PASSWORD")
+        self.debug: str = environ.get("DEBUG")
+        self.neo4j_database_name: str = environ.get("NEO4J_DATABASE_NAME")
+        self.neo4j_data_dir: str = environ.get("NEO4J_DATA_DIR")
+        self.docker_compose_dir: str = environ.get("DOCKER_COMPOSE_DIR")
+        # dict view kept for load_env_variables() callers
+        self._env = {
+            "base_url": self.base_url,
+            "base_port": self.base_port,
+            "base_scheme": self.base_scheme,
+            "build_url": self.build_url,
+            "token_id": self.token_id,
+            "token_key": self.token_key,
+            "username": self.username,
+            "must_change_password": self.must_change_password,
+            "initial_password": self.initial_password,
+            "password": self.password,
+            "new_password": self.new_password,
+            "debug": self.debug,
+            "neo4j_database_name": self.neo4j_database_name,
+            "neo4j_data_dir": self.neo4j_data_dir,
+            "docker_compose_dir": self.docker_compose_dir,
+        }
+
+    def as_dict(self) -> dict:
+        return self._env
+
+
+_config = None
+_config_lock = threading.Lock()
+# configuration of the instance profile active in the current context (fan-out), None for .env
+_active_config = contextvars.ContextVar("bhtk_active_config", default=None)
+
+
+@contextmanager
+def use_config(config: Config):
+    """
+    Make `config` the configuration returned by get_config() in this context (thread / task).
+    Threads started with lib.bulk.submit inherit it.
+    """
+    token = _active_config.set(config)
+    try:
+        yield config
+    finally:
+        _active_config.reset(token)
+
+
+def get_config() -> Config:
+    """
+    Cached configuration, rebuilt only after invalidate()
+    """
+    global _config
+    config = _active_config.get()
+    if config is not None:
+        return config
+    config = _config
+    if config is None:
+        with _config_lock:
+            if _config is None:
+                _config = Config()
+            config = _config
+    return config
+
+
+def invalidate():
+    global _config
+    with _config_lock:
+        _config = None
 
 
 # load env variables
 def load_env_variables():
-    return {
-        "base_url": os.getenv("BHE_DOMAIN"),
-        "base_port": os.getenv("BHE_PORT"),
-        "base_scheme": os.getenv("BHE_SCHEME"),
-        "build_url": f"{os.getenv('BHE_SCHEME')}://{os.getenv('BHE_DOMAIN')}:{os.getenv('BHE_PORT')}",
-        "token_id": os.getenv("BHE_TOKEN_ID"),
-        "token_key": os.getenv("BHE_TOKEN_KEY"),
-        "username": os.getenv("BHE_USERNAME"),
-        "must_change_password": os.getenv("MUST_CHANGE_PASSWORD"),
-        "initial_password": os.getenv("BHE_INITIAL_PASSWORD"),
-        "password": os.getenv("BHE_PASSWORD"),
-        "new_password": os.getenv("BHE_NEW_PASSWORD"),
-        "debug": os.getenv("DEBUG"),
-        "neo4j_database_name": os.getenv("NEO4J_DATABASE_NAME"),
-        "neo4j_data_dir": os.getenv("NEO4J_DATA_DIR"),
-        "docker_compose_dir": os.getenv("DOCKER_COMPOSE_DIR"),
-    }
+    return get_config().as_dict()
 
 
 def base_url():
-    env = load_env_variables()
-    return env["build_url"]
+    return get_config().build_url
 
 
 def update_env_variables(key: str, value: str):
     """
     Update environment variable in both os.environ and .env file
     """
-    os.environ[key] = value
+    update_env_variables_batch({key: value})
+
+
+def update_env_variables_batch(values: dict):
+    """
+    Update several environment variables in os.environ and in the .env file with a single write.
+    The file is written to a temp file and renamed over .env, so readers never see a partial file.
+    """
+    for key, value in values.items():
+        os.environ[key] = value
+    invalidate()
 
     # Read the current .env file
-    env_file_path = ".env"
-    if os.path.exists(env_file_path):
-        with open(env_file_path, "r") as file:
+    lines = []
+    if os.path.exists(ENV_FILE_PATH):
+        with open(ENV_FILE_PATH, "r") as file:
             lines = file.readlines()
+        if lines and not lines[-1].endswith("\n"):
+            lines[-1] += "\n"
+
+    # Update or add the key-value pairs
+    pending = dict(values)
+    for i, line in enumerate(lines):
+        key = line.strip().split("=", 1)[0]
+        if key in pending and line.strip().startswith(f"{key}="):
+            lines[i] = f"{key}={pending.pop(key)}\n"
+    for key, value in pending.items():
+        lines.append(f"{key}={value}\n")
 
-        # Update or add the key-value pair
-        key_found = False
-        for i, line in enumerate(lines):
-            if line.strip().startswith(f"{key}="):
-                lines[i] = f"{key}={value}\n"
-                key_found = True
-                break
-
-        if not key_found:
-            lines.append(f"{key}={value}\n")
-
-        # Write back to .env file
-        with open(env_file_path, "w") as file:
-            file.writelines(lines)
-    else:
-        # Create new .env file if it doesn't exist
-        with open(env_file_path, "w") as file:
-            file.write(f"{key}={value}\n")
+    # Write to a temp file next to .env and atomically replace it
+    temp_path = f"{ENV_FILE_PATH}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "w") as file:
+        file.writelines(lines)
+    if os.path.exists(ENV_FILE_PATH):
+        # keep the permissions of the original file, it holds secrets
+        os.chmod(temp_path, os.stat(ENV_FILE_PATH).st_mode & 0o777)
+    os.replace(temp_path, ENV_FILE_PATH)
@@ -0,0 +1,29 @@
+import os
+import lib.config as config
+
+# local neo4j database helpers, no network needed
+
+
+def list_neo4j_databases(neo4j_data_dir=os.path.join(os.getcwd(), "data", "neo4j-data")):
+    # list the directories in the neo4j data directory
+    # return the directories
+    neo4j_data_dir = os.path.join(neo4j_data_dir, "databases")
+    directories = [
+        d
+        for d in os.listdir(neo4j_data_dir)
+        if d not in ["system", "logs", "store_lock", "transactions", "server_id", "dbms", "databases"]
+    ]
+    return directories
+
+
+def get_current_db():
+    # GET, /api/v2/database
+    current_db = config.load_env_variables()["neo4j_database_name"]
+
+    return current_db
+
+
+def set_current_db(db_name):
+    # set the current database in the .env file
+    config.update_env_variables("NEO4J_DATABASE_NAME", db_name)
+    return db_name
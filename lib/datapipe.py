@@ -0,0 +1,156 @@
+import datetime
+import json
+import os
+import time
+import lib.config as config
+import lib.utils as utils
+
+# datapipe (ingest / analysis) monitoring
+# /api/v2/datapipe/status reports what the pipeline is doing: idle, ingesting, analyzing or purging.
+# the monitor polls fast while the status moves and backs off while it stays the same, and records how long
+# every phase lasted. automation waits with wait_until_idle() instead of sleeping for a guessed time.
+
+DEFAULT_INITIAL_INTERVAL = 1
+DEFAULT_MAX_INTERVAL = 30
+DEFAULT_BACKOFF_FACTOR = 1.5
+# after an analysis request, how long an idle pipeline that never changed is waited for before
+# concluding there was nothing to analyze
+DEFAULT_START_GRACE = 30
+
+IDLE = "idle"
+
+
+def metrics_path():
+    return os.getenv("BHTK_METRICS") or os.path.join(os.getcwd(), "data", "datapipe_metrics.jsonl")
+
+
+class DatapipeMonitor(object):
+    def __init__(
+        self,
+        initial_interval=DEFAULT_INITIAL_INTERVAL,
+        max_interval=DEFAULT_MAX_INTERVAL,
+        backoff_factor=DEFAULT_BACKOFF_FACTOR,
+    ) -> None:
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.polls = 0
+        self.data = None
+        # phase -> seconds spent in it
+        self.phases = {}
+
+    def poll(self):
+        """
+        Return the datapipe status data ({"status": ..., "last_complete_analysis_at": ...}) or an error string
+        """
+        self.polls += 1
+        status_data = utils.datapipe_status()
+        if isinstance(status_data, dict):
+            self.data = status_data.get("data") or {}
+            return self.data
+        return status_data
+
+    def last_complete_analysis(self):
+        status_data = self.poll()
+        return status_data.get("last_complete_analysis_at") if isinstance(status_data, dict) else None
+
+    def wait_until_idle(self, timeout=None, analysis_baseline=None, start_grace=DEFAULT_START_GRACE, verbose=True):
+        """
+        Poll until the datapipe is idle. With analysis_baseline (last_complete_analysis_at read before asking
+        for an analysis), an idle pipeline only counts once the analysis ran: the timestamp changed, or a
+        busy phase was seen, or start_grace seconds passed without anything happening.
+        Return "idle", "failed" or "timeout".
+        """
+        started = time.monotonic()
+        deadline = None if timeout is None else started + timeout
+        interval = self.initial_interval
+        phase = None
+        phase_started = started
+        busy_seen = False
+        while True:
+            status_data = self.poll()
+            now = time.monotonic()
+            if isinstance(status_data, str):
+                if verbose:
+                    print(f"[-] {status_data}")
+                return "failed"
+
+            status = status_data.get("status") or "unknown"
+            if status != phase:
+                if phase is not None:
+                    self.phases[phase] = self.phases.get(phase, 0) + now - phase_started
+                if verbose:
+                    print(f"[datapipe] {status}")
+                phase = status
+                phase_started = now
+                # poll fast again right after a change
+                interval = self.initial_interval
+            if status != IDLE:
+                busy_seen = True
+            elif (
+                analysis_baseline is None
+                or busy_seen
+                or status_data.get("last_complete_analysis_at") != analysis_baseline
+                or now - started >= start_grace
+            ):
+                self.phases[phase] = self.phases.get(phase, 0) + now - phase_started
+                self.phases.pop(IDLE, None)
+                return IDLE
+
+            if deadline is not None and now >= deadline:
+                self.phases[phase] = self.phases.get(phase, 0) + now - phase_started
+                return "timeout"
+            time.sleep(interval if deadline is None else min(interval, deadline - now))
+            interval = min(interval * self.backoff_factor, self.max_interval)
+
+    def timings(self) -> dict:
+        return {phase: round(seconds, 2) for phase, seconds in self.phases.items()}
+
+
+def record_metrics(result: dict, path: str = None):
+    """
+    Append a run (status, phase durations) to the metrics file, one json object per line
+    """
+    path = path or metrics_path()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    record = {"time": datetime.datetime.now().astimezone().isoformat(), "instance": config.base_url(), **result}
+    with open(path, "a") as file:
+        file.write(json.dumps(record) + "\n")
+
+
+def wait_for_analysis(timeout=None, start_analysis=False, verbose=True, metrics=True) -> dict:
+    """
+    Wait until the datapipe is idle, asking for an analysis first with start_analysis.
+    Return {"status", "elapsed", "phases", "polls", "last_complete_analysis_at"}, phases are seconds
+    spent ingesting / analyzing / ... while waiting.
+    """
+    monitor = DatapipeMonitor()
+    started = time.monotonic()
+    analysis_baseline = None
+    if start_analysis:
+        analysis_baseline = monitor.last_complete_analysis()
+        analysis_status = utils.run_analysis()
+        if verbose:
+            print(analysis_status)
+        if analysis_status != "Analysis started":
+            return {
+                "status": "failed",
+                "elapsed": 0,
+                "phases": {},
+                "polls": monitor.polls,
+                "last_complete_analysis_at": None,
+            }
+
+    status = monitor.wait_until_idle(timeout, analysis_baseline, verbose=verbose)
+    result = {
+        "status": status,
+        "elapsed": round(time.monotonic() - started, 2),
+        "phases": monitor.timings(),
+        "polls": monitor.polls,
+        "last_complete_analysis_at": (monitor.data or {}).get("last_complete_analysis_at"),
+    }
+    if metrics:
+        record_metrics(result)
+    return result
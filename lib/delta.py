@@ -0,0 +1,244 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import lib.collection as collection
+import lib.config as config
+import lib.splitter as splitter
+
+# delta uploads
+# the objects of a new collection are compared, by ObjectIdentifier, with the snapshot of what was ingested
+# into the same instance / neo4j database before. only new or changed objects are written to synthetic
+# collection files (same {"data": [...], "meta": {...}} format) and uploaded.
+# the snapshot is an on-disk SQLite index (object id -> content hash), lookups are batched so memory stays
+# bounded on 1M+ object domains. hashes of a run are staged and only merged once its ingest completes.
+
+# ids per IN (...) lookup, plus instance and database it stays under the 999 bound parameters of sqlite < 3.32
+LOOKUP_BATCH_SIZE = 900
+
+_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS objects (
+        instance TEXT NOT NULL,
+        database TEXT NOT NULL,
+        object_id TEXT NOT NULL,
+        type TEXT,
+        domain TEXT,
+        hash BLOB NOT NULL,
+        PRIMARY KEY (instance, database, object_id)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS pending (
+        instance TEXT NOT NULL,
+        database TEXT NOT NULL,
+        object_id TEXT NOT NULL,
+        type TEXT,
+        domain TEXT,
+        hash BLOB NOT NULL,
+        PRIMARY KEY (instance, database, object_id)
+    ) WITHOUT ROWID
+    """,
+]
+
+
+def snapshot_path():
+    return os.getenv("BHTK_SNAPSHOT") or os.path.join(os.getcwd(), "data", "snapshot.sqlite")
+
+
+def _object_key(element):
+    # (object id, domain) of a SharpHound object, (None, None) for anything else
+    if not isinstance(element, dict) or element.get("ObjectIdentifier") is None:
+        return None, None
+    properties = element.get("Properties")
+    domain = properties.get("domain") if isinstance(properties, dict) else None
+    return str(element["ObjectIdentifier"]), domain
+
+
+def _content_hash(element) -> bytes:
+    # key order and whitespace of the collector output don't count
+    canonical = json.dumps(element, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).digest()
+
+
+class Snapshot(object):
+    def __init__(self, path: str = None) -> None:
+        self.path = path or snapshot_path()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        for statement in _SCHEMA:
+            self._connection.execute(statement)
+        self._connection.commit()
+        self._lock = threading.Lock()
+        current_config = config.get_config()
+        self.instance = current_config.build_url
+        self.database = current_config.neo4j_database_name or ""
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def lookup(self, object_ids) -> dict:
+        """
+        object id -> hash in the snapshot, for the ids that are in it
+        """
+        placeholders = ",".join("?" * len(object_ids))
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT object_id, hash FROM objects "
+                f"WHERE instance = ? AND database = ? AND object_id IN ({placeholders})",
+                [self.instance, self.database, *object_ids],
+            ).fetchall()
+        return dict(rows)
+
+    def stage(self, rows):
+        # rows: (object id, type, domain, hash)
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO pending VALUES (?, ?, ?, ?, ?, ?)",
+                [(self.instance, self.database, *row) for row in rows],
+            )
+
+    def discard_pending(self):
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM pending WHERE instance = ? AND database = ?", (self.instance, self.database)
+            )
+            self._connection.commit()
+
+    def commit_pending(self):
+        """
+        Merge the staged hashes into the snapshot, once their ingest completed
+        """
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO objects SELECT * FROM pending WHERE instance = ? AND database = ?",
+                (self.instance, self.database),
+            )
+            self._connection.execute(
+                "DELETE FROM pending WHERE instance = ? AND database = ?", (self.instance, self.database)
+            )
+            self._connection.commit()
+
+    def forget(self):
+        """
+        Forget the objects of the current database (after its graph data was deleted)
+        """
+        with self._lock:
+            for table in ("objects", "pending"):
+                self._connection.execute(
+                    f"DELETE FROM {table} WHERE instance = ? AND database = ?", (self.instance, self.database)
+                )
+            self._connection.commit()
+
+    def flush(self):
+        with self._lock:
+            self._connection.commit()
+
+
+class _DeltaWriter(object):
+    """
+    Synthetic collection file written object by object, meta (with the real count) goes last
+    """
+
+    def __init__(self, path: str, meta: dict) -> None:
+        self.path = path
+        self.meta = meta
+        self.count = 0
+        self.file = None
+
+    def write(self, raw: bytes):
+        if self.file is None:
+            self.file = open(self.path, "wb")
+            self.file.write(b'{"data":[')
+        elif self.count:
+            self.file.write(b",")
+        self.file.write(raw)
+        self.count += 1
+
+    def close(self):
+        if self.file is None:
+            return
+        meta = dict(self.meta)
+        meta["count"] = self.count
+        self.file.write(b'],"meta":' + json.dumps(meta).encode("utf-8") + b"}")
+        self.file.close()
+
+
+def _delta_batch(batch, snapshot, writer, stats):
+    previous = snapshot.lookup([object_id for object_id, _, _, _ in batch if object_id is not None])
+    staged = []
+    for object_id, domain, content_hash, raw in batch:
+        if object_id is None:
+            # can't be tracked, always sent
+            writer.write(raw)
+            stats["untracked"] += 1
+            continue
+        known_hash = previous.get(object_id)
+        if known_hash == content_hash:
+            stats["unchanged"] += 1
+            continue
+        writer.write(raw)
+        stats["new" if known_hash is None else "changed"] += 1
+        staged.append((object_id, writer.meta.get("type"), domain, content_hash))
+    snapshot.stage(staged)
+
+
+def build_delta(data_path: str, output_dir: str, snapshot: Snapshot) -> dict:
+    """
+    Write the new / changed objects of a collection to synthetic collection files in output_dir,
+    and stage their hashes in the snapshot (merged by snapshot.commit_pending() after the ingest).
+    Return the stats: objects, new, changed, unchanged, untracked, files (names written), domains.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    snapshot.discard_pending()
+    stats = {"objects": 0, "new": 0, "changed": 0, "unchanged": 0, "untracked": 0, "files": [], "domains": {}}
+    for collection_file in collection.list_collection_files(data_path):
+        with collection_file.open() as f:
+            meta = splitter.read_meta(f)
+            if meta is None:
+                raise ValueError(f'{collection_file.name}: no "meta" object')
+            f.seek(0)
+            # names of zip members can be member paths, the delta collection is a flat directory
+            writer = _DeltaWriter(os.path.join(output_dir, collection_file.name.replace("/", "__")), meta)
+            try:
+                batch = []
+                for element, raw in splitter.iter_values(f):
+                    stats["objects"] += 1
+                    object_id, domain = _object_key(element)
+                    if domain:
+                        stats["domains"][domain] = stats["domains"].get(domain, 0) + 1
+                    batch.append((object_id, domain, _content_hash(element), raw.encode("utf-8")))
+                    if len(batch) >= LOOKUP_BATCH_SIZE:
+                        _delta_batch(batch, snapshot, writer, stats)
+                        batch = []
+                if batch:
+                    _delta_batch(batch, snapshot, writer, stats)
+            finally:
+                writer.close()
+            if writer.count:
+                stats["files"].append(os.path.basename(writer.path))
+    snapshot.flush()
+    return stats
+
+
+def delta_dir(data_path: str) -> str:
+    """
+    Create the folder of a run's synthetic files, unique per run: concurrent runs (--instances) of the same
+    collection must not write into / remove each other's folder
+    """
+    name = os.path.basename(os.path.normpath(data_path))
+    parent_dir = os.path.join(os.getcwd(), "data", "delta")
+    os.makedirs(parent_dir, exist_ok=True)
+    return tempfile.mkdtemp(prefix=f"{name}_{time.strftime('%Y%m%d_%H%M%S')}_", dir=parent_dir)
+
+
+def remove_delta_dir(output_dir: str):
+    shutil.rmtree(output_dir, ignore_errors=True)
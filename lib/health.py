@@ -0,0 +1,72 @@
+import os
+import threading
+import time
+import lib.config as config
+import lib.utils as utils
+
+# cached liveness state of the BloodHound API
+# _request used to probe /api/v2/sso-providers before every single call, doubling the round trips.
+# the probe now runs once, the result is cached for BHE_HEALTH_TTL seconds and every successful
+# API response refreshes it. connection errors invalidate the cache so the next call probes again.
+
+DEFAULT_TTL = 300
+
+
+class HealthState(object):
+    def __init__(self, ttl: float = DEFAULT_TTL, probe=None) -> None:
+        self.ttl = ttl
+        # resolved at call time, lib.utils may still be importing when this module loads
+        self.probe = probe
+        self.probes_sent = 0
+        self.probes_skipped = 0
+        self.invalidations = 0
+        # base url -> monotonic time of the last known "up" state
+        self._last_up = {}
+        self._lock = threading.Lock()
+
+    def _fresh(self, url: str) -> bool:
+        last_up = self._last_up.get(url)
+        return last_up is not None and time.monotonic() - last_up < self.ttl
+
+    def is_up(self) -> bool:
+        url = config.base_url()
+        with self._lock:
+            if self._fresh(url):
+                self.probes_skipped += 1
+                return True
+        # probe outside of the lock, a slow probe must not block threads using another instance
+        is_up = (self.probe or utils.check_is_up)()
+        with self._lock:
+            self.probes_sent += 1
+            if is_up:
+                self._last_up[url] = time.monotonic()
+        return is_up
+
+    def mark_up(self) -> None:
+        # any response from the API proves it is up
+        with self._lock:
+            self._last_up[config.base_url()] = time.monotonic()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            if self._last_up.pop(config.base_url(), None) is not None:
+                self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "probes_sent": self.probes_sent,
+                "probes_skipped": self.probes_skipped,
+                "invalidations": self.invalidations,
+            }
+
+
+def _env_ttl():
+    try:
+        return float(os.getenv("BHE_HEALTH_TTL", DEFAULT_TTL))
+    except (TypeError, ValueError):
+        return DEFAULT_TTL
+
+
+# shared state used by bh_utils._request
+state = HealthState(ttl=_env_ttl())
@@ -0,0 +1,145 @@
+import os
+import threading
+import requests
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import lib.rate_limit as rate_limit
+
+# shared http client used by every call to the BloodHound API
+# one requests.Session keeps a keep-alive connection pool per host, so bulk operations
+# (saved queries import, file upload chunks, ...) reuse tcp / tls connections instead of
+# opening a new one for every request
+
+USER_AGENT = "bhe-python-sdk 0001"
+
+# tunables, can be overridden from .env
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+DEFAULT_TIMEOUT = 300
+# 429 responses retried after waiting for Retry-After
+DEFAULT_THROTTLE_RETRIES = 5
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def build_session(pool_size=None, max_retries=None, backoff_factor=None):
+    """
+    Build a requests.Session with a keep-alive connection pool and retry / backoff
+    """
+    pool_size = pool_size or _env_int("BHE_POOL_SIZE", DEFAULT_POOL_SIZE)
+    if max_retries is None:
+        max_retries = _env_int("BHE_MAX_RETRIES", DEFAULT_MAX_RETRIES)
+    if backoff_factor is None:
+        backoff_factor = _env_float("BHE_RETRY_BACKOFF", DEFAULT_BACKOFF_FACTOR)
+
+    # only connection level errors and gateway errors are retried, the status codes are
+    # returned to the caller after the last retry so the existing status checks still work
+    retry = Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=0,
+        status=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(["GET", "HEAD", "PUT", "DELETE", "OPTIONS"]),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"User-Agent": USER_AGENT})
+    session.pool_size = pool_size
+    return session
+
+
+def get_session():
+    """
+    Return the process wide session, created on first use
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = build_session()
+    return _session
+
+
+def configure(pool_size=None, max_retries=None, backoff_factor=None):
+    """
+    Replace the shared session with one using the given pool size / retry settings
+    """
+    global _session
+    with _session_lock:
+        old_session = _session
+        _session = build_session(pool_size, max_retries, backoff_factor)
+    if old_session is not None:
+        old_session.close()
+    return _session
+
+
+def ensure_pool_size(pool_size):
+    """
+    Grow the connection pool so `pool_size` threads can keep their own connection
+    """
+    global _session
+    get_session()
+    with _session_lock:
+        if _session.pool_size < pool_size:
+            # the old session isn't closed, other threads may still have requests in flight on it
+            _session = build_session(pool_size)
+        return _session
+
+
+def _origin(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def request(method, url, timeout=None, **kwargs):
+    """
+    Send a request through the shared session.
+    Every request is throttled by the adaptive rate limiter of its host, 429 responses slow the limiter
+    down and are retried after the Retry-After delay.
+    """
+    if timeout is None:
+        timeout = _env_float("BHE_REQUEST_TIMEOUT", DEFAULT_TIMEOUT)
+    throttle_retries = _env_int("BHE_THROTTLE_RETRIES", DEFAULT_THROTTLE_RETRIES)
+    limiter = rate_limit.get_limiter(_origin(url))
+
+    for attempt in range(throttle_retries + 1):
+        limiter.acquire()
+        response = get_session().request(method=method, url=url, timeout=timeout, **kwargs)
+        if response.status_code != 429:
+            limiter.on_success()
+            return response
+        limiter.on_throttle(rate_limit.parse_retry_after(response.headers.get("Retry-After")))
+        if attempt < throttle_retries:
+            response.close()
+    return response
+
+
+def close():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
@@ -0,0 +1,126 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import dotenv
+import lib.bulk as bulk
+import lib.config as config
+import lib.http_client as http_client
+
+# named BloodHound instance profiles and fan-out of an operation over them
+#
+# instances.json:
+# {
+#     "instances": {
+#         "acme": {"BHE_DOMAIN": "bh-acme.lan", "BHE_PORT": "8080", "BHE_SCHEME": "http",
+#                  "BHE_TOKEN_ID": "...", "BHE_TOKEN_KEY": "..."},
+#         "globex": {"env_file": "engagements/globex/.env"}
+#     }
+# }
+#
+# a profile starts from the current environment (.env), then the env_file if any, then its own BHE_* keys.
+# every instance runs in its own thread with lib.config.use_config(), nested pools (uploads, bulk
+# saved queries calls) inherit the profile through lib.bulk.submit.
+
+DEFAULT_INSTANCES_FILE = "instances.json"
+DEFAULT_MAX_PARALLEL = 4
+
+
+def load_profiles(path=DEFAULT_INSTANCES_FILE, only=None) -> dict:
+    """
+    Read the instances file, return {name: Config} in file order.
+    only is a list of names to keep. Raise ValueError on a malformed file or an unknown name.
+    """
+    try:
+        with open(path, "r") as file:
+            data = json.load(file)
+    except (OSError, ValueError) as exc:
+        raise ValueError(f"Failed to read instances file {path}: {exc}")
+
+    instances = data.get("instances") if isinstance(data, dict) else None
+    if not isinstance(instances, dict) or not instances:
+        raise ValueError(f"Failed to read instances file {path}: expected a non empty \"instances\" object")
+
+    if only:
+        unknown = [name for name in only if name not in instances]
+        if unknown:
+            raise ValueError(f"Unknown instances: {', '.join(unknown)}")
+        instances = {name: instances[name] for name in instances if name in only}
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    profiles = {}
+    for name, values in instances.items():
+        if not isinstance(values, dict):
+            raise ValueError(f"Instance {name}: expected an object")
+        environ = dict(os.environ)
+        env_file = values.get("env_file")
+        if env_file:
+            env_path = os.path.join(base_dir, env_file)
+            if not os.path.exists(env_path):
+                raise ValueError(f"Instance {name}: env file {env_path} not found")
+            environ.update({key: value for key, value in dotenv.dotenv_values(env_path).items() if value is not None})
+        environ.update({key: str(value) for key, value in values.items() if key != "env_file"})
+        profiles[name] = config.Config(environ)
+    return profiles
+
+
+def _run_instance(name, profile, operation):
+    started = time.monotonic()
+    result = {"instance": name, "url": profile.build_url, "ok": True, "error": None, "duration": 0.0}
+    with config.use_config(profile):
+        try:
+            # the operation reports a failure by returning False, raising or calling sys.exit
+            if operation(name) is False:
+                result["ok"] = False
+                result["error"] = "operation failed"
+        except SystemExit as exc:
+            if exc.code not in (None, 0):
+                result["ok"] = False
+                result["error"] = f"exited with status {exc.code}"
+        except Exception as exc:
+            result["ok"] = False
+            result["error"] = f"{type(exc).__name__}: {exc}"
+    result["duration"] = round(time.monotonic() - started, 3)
+    return result
+
+
+def run_on_instances(operation, profiles: dict, max_parallel=DEFAULT_MAX_PARALLEL, pool_size=None) -> list:
+    """
+    Call operation(instance_name) once per profile, at most max_parallel instances at a time.
+    pool_size is the number of connections an instance may use, the shared pool is grown accordingly.
+    Return one result per instance, in profile order.
+    """
+    max_parallel = max(1, min(max_parallel, len(profiles) or 1))
+    if pool_size:
+        http_client.ensure_pool_size(max_parallel * pool_size)
+
+    names = list(profiles)
+    results = [None] * len(names)
+    print_lock = threading.Lock()
+    with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        futures = {
+            bulk.submit(executor, _run_instance, name, profiles[name], operation): index
+            for index, name in enumerate(names)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            results[index] = future.result()
+            with print_lock:
+                status = "done" if results[index]["ok"] else "FAILED"
+                print(f"[{names[index]}] {status} in {results[index]['duration']:.1f}s")
+    return results
+
+
+def print_results(results):
+    name_width = max([len("Instance")] + [len(result["instance"]) for result in results])
+    url_width = max([len("URL")] + [len(result["url"]) for result in results])
+    print(f"{'Instance':<{name_width}}  {'URL':<{url_width}}  {'Status':<6}  {'Time':>8}  Error")
+    for result in results:
+        status = "ok" if result["ok"] else "FAILED"
+        print(
+            f"{result['instance']:<{name_width}}  {result['url']:<{url_width}}  {status:<6}  "
+            f"{result['duration']:>7.1f}s  {result['error'] or ''}"
+        )
+    failed = sum(1 for result in results if not result["ok"])
+    print(f"{len(results) - failed}/{len(results)} instances succeeded")
@@ -0,0 +1,111 @@
+import json
+import os
+import threading
+import time
+import lib.config as config
+
+# checkpoint journal of collection uploads
+# every file accepted by BloodHound is appended to <collection>.upload-journal.jsonl (next to the
+# directory / zip), so an interrupted upload can be resumed (--resume) without sending those files again.
+# records are tagged with the instance url, one journal can be shared by several instances (--instances).
+# a "reset" record starts a new run, older records of the same instance are ignored.
+#
+# the upload API takes one whole json document per request, so the journal tracks files. a file sent in parts
+# (lib.splitter) gets one record per accepted part (<name>.partN), a resumed upload only sends the missing parts.
+
+_path_locks = {}
+_path_locks_lock = threading.Lock()
+
+
+def journal_path(data_path: str) -> str:
+    return f"{os.path.normpath(os.path.abspath(data_path))}.upload-journal.jsonl"
+
+
+def _path_lock(path):
+    with _path_locks_lock:
+        return _path_locks.setdefault(path, threading.Lock())
+
+
+class UploadJournal(object):
+    def __init__(self, data_path: str, path: str = None) -> None:
+        self.data_path = data_path
+        self.path = path or journal_path(data_path)
+        self.instance = config.base_url()
+        self._lock = _path_lock(self.path)
+        # state of this instance, rebuilt from the file
+        self.upload_id = None
+        self.ended = True
+        self.accepted = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # torn last line of a killed run
+                    continue
+                if record.get("instance") == self.instance:
+                    self._apply(record)
+
+    def _apply(self, record):
+        event = record.get("event")
+        if event == "reset":
+            self.upload_id = None
+            self.ended = True
+            self.accepted = {}
+        elif event == "start":
+            self.upload_id = record["upload_id"]
+            self.ended = False
+        elif event == "file":
+            self.accepted[record["name"]] = record["size"]
+        elif event == "end":
+            self.ended = True
+
+    def _append(self, record):
+        record["instance"] = self.instance
+        record["time"] = time.time()
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            self._apply(record)
+            with open(self.path, "a") as file:
+                file.write(line)
+                file.flush()
+                os.fsync(file.fileno())
+
+    def reset(self):
+        """
+        Forget the previous runs of this instance (new upload from scratch)
+        """
+        if self.accepted or self.upload_id is not None:
+            self._append({"event": "reset"})
+
+    def start(self, upload_id):
+        self._append({"event": "start", "upload_id": upload_id})
+
+    def record_file(self, upload_id, name: str, size: int):
+        self._append({"event": "file", "upload_id": upload_id, "name": name, "size": size})
+
+    def end(self, upload_id):
+        self._append({"event": "end", "upload_id": upload_id})
+
+    def is_done(self, name: str, size: int) -> bool:
+        # a file that changed size since it was sent is uploaded again
+        with self._lock:
+            return self.accepted.get(name) == size
+
+    def is_complete(self, files) -> bool:
+        """
+        True when every (name, size) of files was accepted and no upload job is left open
+        """
+        return self.open_upload_id() is None and all(self.is_done(name, size) for name, size in files)
+
+    def open_upload_id(self):
+        """
+        Upload job of the previous run that was never ended (killed process), None otherwise
+        """
+        with self._lock:
+            return None if self.ended else self.upload_id
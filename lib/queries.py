@@ -1,32 +1,39 @@
+import hashlib
 import requests
 import json
 import lib.bh_utils as bh_utils
-from time import sleep
+import lib.bulk as bulk
+import lib.cache as cache
 from urllib.parse import quote
 
+# saved queries listed per request
+DEFAULT_PAGE_SIZE = 100
+
 # queries from specterops load https://github.com/SpecterOps/BloodHoundQueryLibrary/releases/latest/download/Queries.json
 # import queries that are not '"prebuilt": true,"'
 
 
-def load_specterops_queries():
-    url = "https://github.com/SpecterOps/BloodHoundQueryLibrary/releases/latest/download/Queries.json"
-    response = requests.get(url)
-    queries = response.json()
+SPECTEROPS_QUERIES_URL = "https://github.com/SpecterOps/BloodHoundQueryLibrary/releases/latest/download/Queries.json"
+
+
+def load_specterops_queries(offline=None):
+    # cached on disk, only downloaded again when the release changed
+    queries = _load_json_from_file_or_url(SPECTEROPS_QUERIES_URL, offline)
     filtered_queries = [query for query in queries if not query.get("prebuilt", False)]
     return filtered_queries
 
 
-# load custom queries from file or url
-def _load_json_from_file_or_url(file_or_url):
+# load custom queries from file or url, urls go through the on-disk cache
+def _load_json_from_file_or_url(file_or_url, offline=None):
     try:
         if file_or_url.startswith("http"):
-            response = requests.get(file_or_url, timeout=30)
-            response.raise_for_status()
-            payload = response.json()
+            payload = cache.fetch_json(file_or_url, offline)
         else:
             with open(file_or_url, "r") as file:
                 payload = json.load(file)
         return payload
+    except cache.CacheMiss as exc:
+        raise ValueError(f"Failed to load JSON from {file_or_url}: {exc}") from exc
     except requests.RequestException as exc:
         raise ValueError(f"Failed to load JSON from {file_or_url}: {exc}") from exc
     except OSError as exc:
@@ -35,23 +42,101 @@ def _load_json_from_file_or_url(file_or_url):
         raise ValueError(f"Failed to parse JSON from {file_or_url}: {exc}") from exc
 
 
-def load_custom_queries(file_or_url):
-    return _load_json_from_file_or_url(file_or_url)
+def load_custom_queries(file_or_url, offline=None):
+    return _load_json_from_file_or_url(file_or_url, offline)
 
 
-def load_custom_icons(file_or_url):
-    return _load_json_from_file_or_url(file_or_url)
+def load_custom_icons(file_or_url, offline=None):
+    return _load_json_from_file_or_url(file_or_url, offline)
 
 
-def import_queries(queries):
-    count = 0
+def _query_text_hash(query_text):
+    # whitespace differences don't make a different query
+    return hashlib.sha256(" ".join((query_text or "").split()).encode("utf-8")).hexdigest()
+
+
+def build_saved_queries_index(saved_queries):
+    # index existing saved queries by name and by query text hash
+    by_name = {}
+    by_hash = {}
+    for saved_query in saved_queries:
+        by_name.setdefault(saved_query.get("name"), saved_query)
+        by_hash.setdefault(_query_text_hash(saved_query.get("query")), saved_query)
+    return by_name, by_hash
+
+
+def plan_import(queries, saved_queries):
+    """
+    Diff the queries to import against the saved queries.
+    Return (to_create, to_update, skipped), to_update is a list of (saved query id, query).
+    """
+    by_name, by_hash = build_saved_queries_index(saved_queries)
+    to_create = []
+    to_update = []
+    skipped = []
+    seen_names = set()
     for query in queries:
-        # print(query)
+        name = query.get("name")
+        # same name twice in the import, the first one wins
+        if name in seen_names:
+            skipped.append(query)
+            continue
+        seen_names.add(name)
+
+        query_hash = _query_text_hash(query.get("query"))
+        existing = by_name.get(name)
+        if existing is not None:
+            if _query_text_hash(existing.get("query")) == query_hash and (existing.get("description") or "") == (
+                query.get("description") or ""
+            ):
+                skipped.append(query)
+            else:
+                to_update.append((existing.get("id"), query))
+        elif query_hash in by_hash:
+            # same cypher already saved under another name
+            skipped.append(query)
+        else:
+            to_create.append(query)
+    return to_create, to_update, skipped
+
+
+def _write_query(operation):
+    action, query_id, query = operation
+    if action == "create":
         # ("POST", "/api/v2/saved-queries", body)
-        bh_utils.pass_request("POST", "/api/v2/saved-queries", query)
-        print(f"[{count}] Imported query: {query.get('name')}")
+        response = bh_utils.pass_request("POST", "/api/v2/saved-queries", query, compress=True)
+    else:
+        payload = {"name": query.get("name"), "query": query.get("query"), "description": query.get("description", "")}
+        response = bh_utils.pass_request("PUT", f"/api/v2/saved-queries/{query_id}", payload, compress=True)
+    return response.status_code
+
+
+def import_queries(queries, workers=bulk.DEFAULT_WORKERS):
+    """
+    Import saved queries, only creating / updating what changed compared to the existing saved queries.
+    Writes go through `workers` concurrent requests, throttled by the shared rate limiter of the request layer.
+    """
+    to_create, to_update, skipped = plan_import(queries, get_saved_queries())
+    operations = [("create", None, query) for query in to_create]
+    operations += [("update", query_id, query) for query_id, query in to_update]
+
+    report = {"created": 0, "updated": 0, "skipped": len(skipped), "failed": 0}
+    count = 0
+    for operation, status_code, error in bulk.run_concurrent(_write_query, operations, workers):
+        action, _, query = operation
+        if error is None and status_code in [200, 201]:
+            report["created" if action == "create" else "updated"] += 1
+            print(f"[{count}] {'Imported' if action == 'create' else 'Updated'} query: {query.get('name')}")
+        else:
+            report["failed"] += 1
+            print(f"[{count}] Failed to {action} query: {query.get('name')} ({error or f'HTTP {status_code}'})")
         count += 1
-        sleep(0.2)
+
+    print(
+        f"Created: {report['created']}, updated: {report['updated']}, "
+        f"skipped: {report['skipped']}, failed: {report['failed']}"
+    )
+    return report
 
 
 def get_custom_node(kind_name):
@@ -120,7 +205,7 @@ def import_custom_icons(custom_icons):
             print(f" - {kind_name}")
         return False
 
-    response = bh_utils.pass_request("POST", "/api/v2/custom-nodes", custom_icons)
+    response = bh_utils.pass_request("POST", "/api/v2/custom-nodes", custom_icons, compress=True)
     if response.status_code == 200 or response.status_code == 201:
         print(f"Imported custom icons for {len(custom_types)} custom node kinds")
         return True
@@ -130,18 +215,102 @@ def import_custom_icons(custom_icons):
     return False
 
 
-def delete_all_saved_queries():
+def filter_saved_queries(saved_queries, name_prefix=None, owner=None):
+    # lazy filter, by name prefix and by owner (user id)
+    for saved_query in saved_queries:
+        if name_prefix is not None and not (saved_query.get("name") or "").startswith(name_prefix):
+            continue
+        if owner is not None and saved_query.get("user_id") != owner:
+            continue
+        yield saved_query
+
+
+def _run_bulk(action, func, saved_queries, workers):
+    # run func on every saved query, print progress as results come in and never stop on a failure
+    report = {"done": 0, "failed": 0}
     count = 0
-    for query in get_saved_queries():
-        bh_utils.pass_request("DELETE", f"/api/v2/saved-queries/{query.get('id')}")
-        print(f"[{count}] Deleted query: {query.get('name')}")
+    for saved_query, status_code, error in bulk.run_concurrent(func, saved_queries, workers):
+        if error is None and status_code in [200, 201, 204]:
+            report["done"] += 1
+            print(f"[{count}] {action} query: {saved_query.get('name')}")
+        else:
+            report["failed"] += 1
+            print(f"[{count}] Failed: {action} query {saved_query.get('name')} ({error or f'HTTP {status_code}'})")
         count += 1
-        sleep(0.2)
+    print(f"{action}: {report['done']}, failed: {report['failed']}")
+    return report
+
+
+def _delete_saved_query(saved_query):
+    return bh_utils.pass_request("DELETE", f"/api/v2/saved-queries/{saved_query.get('id')}").status_code
+
+
+def delete_saved_queries(
+    name_prefix=None, owner=None, scope=None, workers=bulk.DEFAULT_WORKERS, page_size=DEFAULT_PAGE_SIZE
+):
+    """
+    Delete the saved queries matching the filters with `workers` concurrent requests
+    """
+    # walk the pages from the end, deleting a query doesn't shift the pages that are still to be read
+    saved_queries = iter_saved_queries(page_size, from_end=True, scope=scope)
+    return _run_bulk("Deleted", _delete_saved_query, filter_saved_queries(saved_queries, name_prefix, owner), workers)
+
+
+def delete_all_saved_queries(page_size=DEFAULT_PAGE_SIZE, workers=bulk.DEFAULT_WORKERS):
+    return delete_saved_queries(workers=workers, page_size=page_size)
+
+
+def _get_saved_queries_page(skip, limit, scope=None):
+    # GET, /api/v2/saved-queries?skip=<skip>&limit=<limit>&sort_by=id&scope=<owned,shared,public>
+    # skip / limit paging (and deleting from the end while listing) needs a stable order
+    endpoint = f"/api/v2/saved-queries?skip={skip}&limit={limit}&sort_by=id"
+    if scope is not None:
+        endpoint += f"&scope={quote(scope, safe=',')}"
+    response = bh_utils.pass_request("GET", endpoint)
+    if response.status_code != 200:
+        raise ValueError(f"Failed to list saved queries (HTTP {response.status_code}): {response.text}")
+    payload = response.json()
+    return payload.get("data") or [], payload.get("count")
+
+
+def iter_saved_queries(page_size=DEFAULT_PAGE_SIZE, from_end=False, scope=None):
+    """
+    Yield the saved queries page by page, the next page is only requested once the current one is consumed.
+    With from_end, the last page is read first (and each page in reverse order), so the caller can delete
+    the yielded queries while iterating. scope is passed to the API (owned, shared, public, all).
+    """
+    page, count = _get_saved_queries_page(0, page_size, scope)
+    if not from_end:
+        skip = 0
+        while page:
+            yield from page
+            skip += len(page)
+            if len(page) < page_size or (count is not None and skip >= count):
+                return
+            page, count = _get_saved_queries_page(skip, page_size, scope)
+        return
+
+    if count is None:
+        # no total in the response, the pages can't be walked backwards
+        saved_queries = list(page)
+        skip = len(page)
+        while len(page) == page_size:
+            page, _ = _get_saved_queries_page(skip, page_size, scope)
+            saved_queries.extend(page)
+            skip += len(page)
+        yield from reversed(saved_queries)
+        return
+
+    # the first page is already in hand and deletes at higher offsets don't move it
+    last_skip = ((count - 1) // page_size) * page_size if count > 0 else 0
+    for skip in range(last_skip, 0, -page_size):
+        yield from reversed(_get_saved_queries_page(skip, page_size, scope)[0])
+    yield from reversed(page)
 
 
 # get all saved queries
-def get_saved_queries():
-    return bh_utils.pass_request("GET", "/api/v2/saved-queries").json()["data"]
+def get_saved_queries(page_size=DEFAULT_PAGE_SIZE):
+    return list(iter_saved_queries(page_size))
 
 
 # set to Public by default
@@ -162,19 +331,29 @@ def set_query_scope(query_id, public=True, users=None):
 
 
 # set to Public by default
-def set_queries_permissions(public=True, users=None):
-    queries_list = get_saved_queries()
-    # iterate over all saved queries
-    for query in queries_list:
-        query_id = query.get("id")
-        # query_name = query.get("name")
-        # query_scope = query.get("scope")
-        # print(f"[{query_id}] Query: {query_name}, Scope: {query_scope}")
-        if users is not None:
-            set_query_scope(query_id, public, users)
-        else:
-            set_query_scope(query_id, public)
-        sleep(0.2)
+def set_queries_permissions(
+    public=True,
+    users=None,
+    name_prefix=None,
+    owner=None,
+    scope=None,
+    workers=bulk.DEFAULT_WORKERS,
+    page_size=DEFAULT_PAGE_SIZE,
+):
+    """
+    Set the permissions of the saved queries matching the filters with `workers` concurrent requests
+    """
+    payload = {"public": public, "user_ids": users or []}
+
+    def set_permissions(saved_query):
+        return bh_utils.pass_request(
+            "PUT", f"/api/v2/saved-queries/{saved_query.get('id')}/permissions", payload
+        ).status_code
+
+    # iterate over all saved queries, page by page
+    saved_queries = filter_saved_queries(iter_saved_queries(page_size, scope=scope), name_prefix, owner)
+    action = f"Set scope public={public} users={payload['user_ids']} on"
+    return _run_bulk(action, set_permissions, saved_queries, workers)
 
 
 def convert_legacy_queries(queries):
@@ -0,0 +1,148 @@
+import datetime
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+# rate limiting for API calls
+# every request sent through lib.http_client acquires a token from the limiter of its host.
+# the rate adapts with AIMD: it grows a little after every successful request and is cut in half
+# on every 429, which also pauses all requests to that host for the Retry-After delay.
+
+DEFAULT_RATE = 10
+DEFAULT_MIN_RATE = 0.5
+DEFAULT_MAX_RATE = 100
+DEFAULT_INCREASE = 0.5
+DEFAULT_DECREASE_FACTOR = 0.5
+# pause used when a 429 comes without a usable Retry-After header
+DEFAULT_RETRY_AFTER = 1
+
+
+class TokenBucket(object):
+    """
+    Classic token bucket: `rate` tokens per second, up to `burst` tokens saved while idle.
+    acquire() blocks until a token is available, it is safe to share between threads.
+    """
+
+    def __init__(self, rate: float, burst: float = None) -> None:
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _wait_time(self, now: float, tokens: float) -> float:
+        # called with the lock held, 0 when the tokens were taken
+        self._refill(now)
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return 0
+        return (tokens - self.tokens) / self.rate
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """
+        Take the tokens if available and return 0, otherwise return how long to wait before trying again
+        """
+        with self._lock:
+            return self._wait_time(time.monotonic(), tokens)
+
+    def acquire(self, tokens: float = 1) -> None:
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+
+class AdaptiveRateLimiter(TokenBucket):
+    """
+    Token bucket whose rate follows AIMD (additive increase, multiplicative decrease)
+    driven by the 429 responses of the server
+    """
+
+    def __init__(
+        self,
+        rate: float = DEFAULT_RATE,
+        min_rate: float = DEFAULT_MIN_RATE,
+        max_rate: float = DEFAULT_MAX_RATE,
+        increase: float = DEFAULT_INCREASE,
+        decrease_factor: float = DEFAULT_DECREASE_FACTOR,
+    ) -> None:
+        super().__init__(rate, burst=1)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.paused_until = 0.0
+        self.throttled = 0
+
+    def _wait_time(self, now: float, tokens: float) -> float:
+        if now < self.paused_until:
+            return self.paused_until - now
+        return super()._wait_time(now, tokens)
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self, retry_after: float = None) -> None:
+        with self._lock:
+            self.throttled += 1
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            # drop saved tokens so the lower rate applies right away
+            self.tokens = 0
+            pause = retry_after if retry_after is not None else DEFAULT_RETRY_AFTER
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"rate": round(self.rate, 2), "throttled": self.throttled}
+
+
+def parse_retry_after(value):
+    """
+    Retry-After is either a number of seconds or an HTTP date. Return seconds or None.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_date.tzinfo is None:
+        retry_date = retry_date.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (retry_date - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(origin: str) -> AdaptiveRateLimiter:
+    """
+    Shared limiter of a host (scheme://host:port)
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(origin)
+        if limiter is None:
+            limiter = AdaptiveRateLimiter(
+                rate=_env_float("BHE_RATE_LIMIT", DEFAULT_RATE),
+                max_rate=_env_float("BHE_RATE_LIMIT_MAX", DEFAULT_MAX_RATE),
+            )
+            _limiters[origin] = limiter
+        return limiter
@@ -0,0 +1,171 @@
+import json
+import os
+import subprocess
+import time
+import requests
+import lib.config as config
+import lib.health as health
+import lib.utils as utils
+
+# readiness of the docker compose stack after a start / restart
+# `docker compose up -d` returns as soon as the containers are created, neo4j and bloodhound take from a few
+# seconds to several minutes (big graph) before serving. instead of sleeping for a guessed time, the waiter
+# polls the compose healthchecks (`docker compose ps --format json`) and the API, backing off exponentially
+# until everything is up or the deadline passes.
+
+DEFAULT_TIMEOUT = 300
+DEFAULT_INITIAL_INTERVAL = 1
+DEFAULT_MAX_INTERVAL = 15
+DEFAULT_BACKOFF_FACTOR = 2
+PROBE_TIMEOUT = 5
+# unauthenticated endpoint, answers once the API is serving
+PROBE_ENDPOINT = "/api/v2/sso-providers"
+
+READY = "ready"
+
+
+def ready_timeout() -> float:
+    try:
+        return float(os.getenv("BHTK_READY_TIMEOUT", DEFAULT_TIMEOUT))
+    except (TypeError, ValueError):
+        return DEFAULT_TIMEOUT
+
+
+def _compose_dir():
+    # same lookup as utils.start_containers
+    if os.path.exists(os.path.join(utils._docker_compose_dir(), "docker-compose.yml")):
+        return utils._docker_compose_dir()
+    if os.path.exists(os.path.join(utils.current_dir, "docker-compose.yml")):
+        return utils.current_dir
+    return None
+
+
+def _parse_ps_output(output: str) -> list:
+    # compose < 2.21 prints a json array, newer versions one json object per line
+    output = output.strip()
+    if not output:
+        return []
+    if output.startswith("["):
+        return json.loads(output)
+    return [json.loads(line) for line in output.splitlines() if line.strip()]
+
+
+def compose_services():
+    """
+    Return the compose services as [{"service", "state", "health", "exit_code"}], None when there is no compose
+    stack to watch (no docker / compose file, remote instance) or "Failed to get compose status" on error
+    """
+    compose_dir = _compose_dir()
+    if compose_dir is None:
+        return None
+    try:
+        result = subprocess.run(
+            ["docker", "compose", "ps", "--all", "--format", "json"],
+            cwd=compose_dir,
+            capture_output=True,
+            text=True,
+            timeout=30,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if result.returncode != 0:
+        return "Failed to get compose status"
+    try:
+        containers = _parse_ps_output(result.stdout)
+    except ValueError:
+        return "Failed to get compose status"
+    return [
+        {
+            "service": container.get("Service") or container.get("Name"),
+            "state": (container.get("State") or "").lower(),
+            "health": (container.get("Health") or "").lower(),
+            "exit_code": container.get("ExitCode"),
+        }
+        for container in containers
+    ]
+
+
+def services_state(services: list):
+    """
+    Return (ready, waiting, failed) service names. A service with a healthcheck is ready once healthy,
+    one without once running. A container that exited with code 0 (one-shot init / migration) is done,
+    a non zero exit, a dead container or a failed healthcheck is failed.
+    """
+    ready, waiting, failed = [], [], []
+    for service in services:
+        if service["state"] == "exited" and service["exit_code"] == 0:
+            ready.append(service["service"])
+        elif service["state"] in ("exited", "dead") or service["health"] == "unhealthy":
+            failed.append(service["service"])
+        elif service["state"] == "running" and service["health"] in ("", "healthy"):
+            ready.append(service["service"])
+        else:
+            waiting.append(service["service"])
+    return ready, waiting, failed
+
+
+def api_serving() -> bool:
+    # quiet version of utils.check_is_up, connection errors are expected while the containers start
+    try:
+        response = requests.get(config.base_url() + PROBE_ENDPOINT, timeout=PROBE_TIMEOUT)
+    except requests.exceptions.RequestException:
+        return False
+    # 5xx: the proxy / app is up but not serving yet
+    return response.status_code < 500
+
+
+def wait_until_ready(
+    timeout=None,
+    initial_interval=DEFAULT_INITIAL_INTERVAL,
+    max_interval=DEFAULT_MAX_INTERVAL,
+    backoff_factor=DEFAULT_BACKOFF_FACTOR,
+    verbose=True,
+) -> dict:
+    """
+    Wait until the compose services are healthy / running and the API answers.
+    Return {"status": "ready" | "failed" | "timeout", "elapsed", "checks", "waiting"}, waiting lists
+    what was still not ready (services, "api") when giving up.
+    """
+    if timeout is None:
+        timeout = ready_timeout()
+    started = time.monotonic()
+    deadline = started + timeout
+    interval = initial_interval
+    checks = 0
+    last_state = None
+    while True:
+        checks += 1
+        services = compose_services()
+        waiting = []
+        failed = []
+        if isinstance(services, list):
+            _, waiting, failed = services_state(services)
+        elif isinstance(services, str) and verbose and last_state is None:
+            print(f"[!] {services}, only watching the API")
+        # the API is only probed once the containers are up, it can't answer before
+        api_up = not waiting and not failed and api_serving()
+        if not api_up and not failed:
+            waiting.append("api")
+
+        now = time.monotonic()
+        state = (tuple(waiting), tuple(failed))
+        if state != last_state:
+            if verbose and waiting:
+                print(f"[ready] waiting for {', '.join(waiting)}")
+            last_state = state
+            # check fast again right after a change
+            interval = initial_interval
+
+        if failed:
+            status = "failed"
+            waiting = failed
+        elif not waiting:
+            status = READY
+            health.state.mark_up()
+        elif now >= deadline:
+            status = "timeout"
+        else:
+            time.sleep(min(interval, deadline - now))
+            interval = min(interval * backoff_factor, max_interval)
+            continue
+        return {"status": status, "elapsed": round(now - started, 2), "checks": checks, "waiting": waiting}
@@ -0,0 +1,104 @@
+import base64
+import datetime
+import hashlib
+import hmac
+import threading
+from collections import OrderedDict
+
+# https://bloodhound.specterops.io/integrations/bloodhound-api/working-with-api
+#
+# request signing for the BloodHound API (bhesignature)
+# the first two links of the HMAC chain only depend on method + path and on the current hour,
+# so the resulting key is cached per (method, path, hour) and only the body is hashed per request.
+
+DEFAULT_CACHE_SIZE = 512
+
+
+class RequestSigner(object):
+    def __init__(self, token_id: str, token_key: str, cache_size: int = DEFAULT_CACHE_SIZE) -> None:
+        self.token_id = token_id
+        self.token_key = token_key
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # (method, path, hour) -> DateKey digest, least recently used first
+        self._date_keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _compute_date_key(self, method: str, path: str, hour: str) -> bytes:
+        # Digester is initialized with HMAC-SHA-256 using the token key as the HMAC digest key.
+        #
+        # OperationKey is the first HMAC digest link in the signature chain. This prevents replay attacks that seek
+        # to modify the request method or URI. It is composed of concatenating the request method and the request
+        # URI with no delimiter and computing the HMAC digest using the token key as the digest secret.
+        #
+        # Example: GET /api/v2/test/resource HTTP/1.1
+        # Signature Component: GET/api/v2/test/resource
+        operation_key = hmac.new(self.token_key.encode(), f"{method}{path}".encode(), hashlib.sha256).digest()
+
+        # DateKey is the next HMAC digest link in the signature chain. This encodes the RFC3339 formatted datetime
+        # value as part of the signature to the hour to prevent replay attacks that are older than max two hours.
+        # This value is added to the signature chain by cutting off all values from the RFC3339 formatted datetime
+        # from the hours value forward:
+        #
+        # Example: 2020-12-01T23:59:60Z
+        # Signature Component: 2020-12-01T23
+        return hmac.new(operation_key, hour.encode(), hashlib.sha256).digest()
+
+    def date_key(self, method: str, path: str, hour: str) -> bytes:
+        cache_key = (method, path, hour)
+        with self._lock:
+            date_key = self._date_keys.get(cache_key)
+            if date_key is not None:
+                self._date_keys.move_to_end(cache_key)
+                self.cache_hits += 1
+                return date_key
+            self.cache_misses += 1
+        date_key = self._compute_date_key(method, path, hour)
+        with self._lock:
+            self._date_keys[cache_key] = date_key
+            if len(self._date_keys) > self.cache_size:
+                self._date_keys.popitem(last=False)
+        return date_key
+
+    def body_digester(self, method: str, path: str, now: datetime.datetime = None):
+        """
+        Return (RequestDate value, digester). Feed the body to digester.update() (in chunks for large
+        bodies), the Signature header is base64(digester.digest()).
+        """
+        datetime_formatted = (now or datetime.datetime.now().astimezone()).isoformat("T")
+        # Body signing is the last HMAC digest link in the signature chain. This encodes the request body as part
+        # of the signature to prevent replay attacks that seek to modify the payload of a signed request. In the
+        # case where there is no body content the HMAC digest is computed anyway, simply with no values written
+        # to the digester.
+        digester = hmac.new(self.date_key(method, path, datetime_formatted[:13]), None, hashlib.sha256)
+        return datetime_formatted, digester
+
+    def sign(self, method: str, path: str, body: bytes = None, now: datetime.datetime = None):
+        """
+        Return the (RequestDate, Signature) header values of a request with an in-memory body
+        """
+        datetime_formatted, digester = self.body_digester(method, path, now)
+        if body is not None:
+            digester.update(body)
+        return datetime_formatted, base64.b64encode(digester.digest())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"cache_hits": self.cache_hits, "cache_misses": self.cache_misses, "cached": len(self._date_keys)}
+
+
+_signers = {}
+_signers_lock = threading.Lock()
+
+
+def get_signer(token_id: str, token_key: str) -> RequestSigner:
+    """
+    Shared signer of an API token, a new token gets a new signer (and an empty cache)
+    """
+    with _signers_lock:
+        signer = _signers.get((token_id, token_key))
+        if signer is None:
+            signer = RequestSigner(token_id, token_key)
+            _signers[(token_id, token_key)] = signer
+        return signer
@@ -0,0 +1,198 @@
+import codecs
+import json
+import re
+
+# streaming splitter of oversized collection files
+# a collector file is {"data": [...], "meta": {...}}. large files are cut into valid sub-documents of at
+# most max_size bytes, each carrying the original meta with its own count, so they can be uploaded as
+# separate files of the same upload job. the file is read incrementally, memory is bounded by the part size,
+# not the file size. elements are copied as is, they are parsed only to find where they end.
+
+DEFAULT_SPLIT_SIZE = 100 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+META_PROBE_SIZE = 64 * 1024
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_decoder = json.JSONDecoder()
+
+
+def _meta_after(text, index):
+    # decode the object following "meta" at index, None if it isn't a complete object
+    colon = _WHITESPACE.match(text, index + len('"meta"')).end()
+    if text[colon : colon + 1] != ":":
+        return None, None
+    try:
+        meta, end = _decoder.raw_decode(text, _WHITESPACE.match(text, colon + 1).end())
+    except ValueError:
+        return None, None
+    return (meta, end) if isinstance(meta, dict) else (None, None)
+
+
+def read_meta(file_obj):
+    """
+    Return the top level "meta" object of a collection file, None if there is none.
+    SharpHound writes meta after data, so the tail is read first. file_obj must be seekable
+    (zip members are, by decompressing again from the start).
+    """
+    file_obj.seek(0, 2)
+    size = file_obj.tell()
+    file_obj.seek(max(0, size - META_PROBE_SIZE))
+    tail = file_obj.read().decode("utf-8", errors="replace")
+    index = tail.rfind('"meta"')
+    if index != -1:
+        meta, end = _meta_after(tail, index)
+        # only the top level meta is followed by the closing brace of the document
+        if meta is not None and tail[end:].strip() == "}":
+            file_obj.seek(0)
+            return meta
+
+    # meta written before data
+    file_obj.seek(0)
+    head = file_obj.read(META_PROBE_SIZE).decode("utf-8-sig", errors="replace")
+    file_obj.seek(0)
+    meta_index = head.find('"meta"')
+    data_index = head.find('"data"')
+    if meta_index != -1 and (data_index == -1 or meta_index < data_index):
+        meta, _ = _meta_after(head, meta_index)
+        return meta
+    return None
+
+
+class _Reader(object):
+    """
+    Incremental utf-8 text buffer over a binary file
+    """
+
+    def __init__(self, file_obj, read_size: int = READ_SIZE) -> None:
+        self.file_obj = file_obj
+        self.read_size = read_size
+        self.decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size=None) -> bool:
+        if self.eof:
+            return False
+        chunk = self.file_obj.read(size or self.read_size)
+        if not chunk:
+            self.eof = True
+            self.buffer += self.decoder.decode(b"", final=True)
+            return False
+        # drop what was consumed before growing the buffer
+        self.buffer = self.buffer[self.pos :] + self.decoder.decode(chunk)
+        self.pos = 0
+        return True
+
+    def skip_whitespace(self):
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or not self.fill():
+                return
+
+    def peek(self) -> str:
+        self.skip_whitespace()
+        return self.buffer[self.pos : self.pos + 1]
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"Invalid collection file: expected {char!r} at {self.buffer[self.pos:self.pos + 20]!r}")
+        self.pos += 1
+
+    def value(self):
+        """
+        Parse the next json value, return (value, raw text)
+        """
+        self.skip_whitespace()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+                # a number (or literal) ending with the buffer may continue in the next read
+                if end < len(self.buffer) or self.eof:
+                    raw = self.buffer[self.pos : end]
+                    self.pos = end
+                    return value, raw
+            except ValueError:
+                if self.eof:
+                    raise ValueError("Invalid collection file: truncated or malformed json")
+            # grow geometrically, a huge element must not be parsed again for every 1 MB read
+            self.fill(max(self.read_size, len(self.buffer) - self.pos))
+
+
+def iter_elements(file_obj, read_size: int = READ_SIZE):
+    """
+    Yield the raw utf-8 bytes of every element of the top level "data" array
+    """
+    for _, raw in iter_values(file_obj, read_size):
+        yield raw.encode("utf-8")
+
+
+def iter_values(file_obj, read_size: int = READ_SIZE):
+    """
+    Yield (parsed value, raw text) of every element of the top level "data" array
+    """
+    reader = _Reader(file_obj, read_size)
+    reader.expect("{")
+    while True:
+        key, _ = reader.value()
+        reader.expect(":")
+        if key != "data":
+            # meta (or anything else) is small, skip it
+            reader.value()
+        else:
+            reader.expect("[")
+            if reader.peek() == "]":
+                return
+            while True:
+                yield reader.value()
+                separator = reader.peek()
+                reader.pos += 1
+                if separator == "]":
+                    return
+                if separator != ",":
+                    raise ValueError(f"Invalid collection file: expected ',' or ']' in data, got {separator!r}")
+        separator = reader.peek()
+        reader.pos += 1
+        if separator != ",":
+            raise ValueError('Invalid collection file: no "data" array')
+
+
+def _build_part(elements, meta):
+    part_meta = dict(meta)
+    part_meta["count"] = len(elements)
+    # a single join, the part is the only full size copy
+    pieces = [b'{"data":[']
+    for index, element in enumerate(elements):
+        if index:
+            pieces.append(b",")
+        pieces.append(element)
+    pieces.append(b'],"meta":' + json.dumps(part_meta).encode("utf-8") + b"}")
+    return b"".join(pieces)
+
+
+def iter_parts(file_obj, max_size: int = DEFAULT_SPLIT_SIZE, meta: dict = None):
+    """
+    Yield the collection file as json documents of at most max_size bytes (an element bigger than
+    max_size gets a document of its own). Raise ValueError when the file has no meta or isn't a collection file.
+    """
+    if meta is None:
+        meta = read_meta(file_obj)
+        if meta is None:
+            raise ValueError('Invalid collection file: no "meta" object')
+    file_obj.seek(0)
+    # room for the envelope and the meta
+    budget = max_size - len(_build_part([], meta)) - 32
+
+    elements = []
+    size = 0
+    for element in iter_elements(file_obj):
+        if elements and size + len(element) + 1 > budget:
+            part = _build_part(elements, meta)
+            elements = []
+            size = 0
+            yield part
+            part = None
+        elements.append(element)
+        size += len(element) + 1
+    if elements:
+        yield _build_part(elements, meta)
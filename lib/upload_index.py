@@ -0,0 +1,109 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import lib.config as config
+
+# content-addressed index of the collection files ingested by each instance / neo4j database
+# uploads record the sha256 of every accepted file, the entries are confirmed once the upload job
+# completes. with --skip-unchanged, files already ingested into the current database are not sent again
+# (daily collections of the same domains often have byte-identical gpos / ous / containers / domains files).
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ingested (
+    sha256 TEXT NOT NULL,
+    instance TEXT NOT NULL,
+    database TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    upload_id INTEGER,
+    upload_seconds REAL NOT NULL DEFAULT 0,
+    confirmed INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (sha256, instance, database)
+)
+"""
+
+
+def index_path():
+    return os.getenv("BHTK_UPLOAD_INDEX") or os.path.join(os.getcwd(), "data", "upload_index.sqlite")
+
+
+def file_sha256(collection_file) -> str:
+    sha256 = hashlib.sha256()
+    with collection_file.open() as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class UploadIndex(object):
+    def __init__(self, path: str = None) -> None:
+        self.path = path or index_path()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # one connection shared by the upload workers, sqlite calls are serialized by the lock
+        self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(_SCHEMA)
+        self._connection.commit()
+        self._lock = threading.Lock()
+        # the target of the current context (instance profile, database)
+        current_config = config.get_config()
+        self.instance = current_config.build_url
+        self.database = current_config.neo4j_database_name or ""
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def ingested(self, sha256: str):
+        """
+        Return (upload_id, upload_seconds) if the file was ingested into the current database, None otherwise
+        """
+        with self._lock:
+            return self._connection.execute(
+                "SELECT upload_id, upload_seconds FROM ingested "
+                "WHERE sha256 = ? AND instance = ? AND database = ? AND confirmed = 1",
+                (sha256, self.instance, self.database),
+            ).fetchone()
+
+    def record(self, sha256: str, name: str, size: int, upload_id, upload_seconds: float):
+        # unconfirmed until the upload job completes
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO ingested VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?)",
+                (sha256, self.instance, self.database, name, size, upload_id, upload_seconds, time.time()),
+            )
+            self._connection.commit()
+
+    def confirm(self, upload_id, complete: bool):
+        """
+        Confirm the files of a finished upload job, or forget them if the ingest didn't complete
+        """
+        with self._lock:
+            if complete:
+                self._connection.execute(
+                    "UPDATE ingested SET confirmed = 1 WHERE upload_id = ? AND instance = ? AND database = ?",
+                    (upload_id, self.instance, self.database),
+                )
+            else:
+                self._connection.execute(
+                    "DELETE FROM ingested WHERE upload_id = ? AND instance = ? AND database = ? AND confirmed = 0",
+                    (upload_id, self.instance, self.database),
+                )
+            self._connection.commit()
+
+    def forget(self):
+        """
+        Forget everything ingested into the current database (after its graph data was cleared)
+        """
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM ingested WHERE instance = ? AND database = ?", (self.instance, self.database)
+            )
+            self._connection.commit()
@@ -0,0 +1,126 @@
+import datetime
+import time
+import lib.utils as utils
+
+# upload job completion tracking
+# a job is followed by its own upload id, polling fast right after the upload ends and backing off
+# up to max_interval while the ingest runs. the throughput is computed from the job status fields.
+
+DEFAULT_INITIAL_INTERVAL = 1
+DEFAULT_MAX_INTERVAL = 30
+DEFAULT_BACKOFF_FACTOR = 1.5
+
+# status codes of /api/v2/file-upload jobs
+UPLOAD_STATUS_NAMES = {
+    -1: "invalid",
+    0: "ready",
+    1: "running",
+    2: "complete",
+    3: "canceled",
+    4: "timed out",
+    5: "failed",
+    6: "ingesting",
+    7: "analyzing",
+    8: "partially complete",
+}
+
+
+def parse_timestamp(value):
+    """
+    Parse an RFC3339 timestamp from the API. Return None for empty / zero values.
+    """
+    if not value or value.startswith("0001-01-01"):
+        return None
+    value = value.replace("Z", "+00:00")
+    # the API can return nanoseconds, python only handles microseconds
+    if "." in value:
+        head, tail = value.split(".", 1)
+        digits = len(tail) - len(tail.lstrip("0123456789"))
+        value = f"{head}.{tail[:digits][:6].ljust(6, '0')}{tail[digits:]}"
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def throughput(upload_data, bytes_sent=None):
+    """
+    Ingest throughput of an upload job from its status fields: start_time -> end_time (or last_ingest / now)
+    """
+    start_time = parse_timestamp(upload_data.get("start_time"))
+    if start_time is None:
+        return None
+    end_time = parse_timestamp(upload_data.get("end_time")) or parse_timestamp(upload_data.get("last_ingest"))
+    if end_time is None or end_time < start_time:
+        end_time = datetime.datetime.now(datetime.timezone.utc)
+    elapsed = max((end_time - start_time).total_seconds(), 0.001)
+    total_files = upload_data.get("total_files") or 0
+    result = {
+        "elapsed": round(elapsed, 2),
+        "files": total_files,
+        "failed_files": upload_data.get("failed_files") or 0,
+        "files_per_second": round(total_files / elapsed, 2),
+    }
+    if bytes_sent is not None:
+        result["bytes"] = bytes_sent
+        result["bytes_per_second"] = round(bytes_sent / elapsed, 2)
+    return result
+
+
+class UploadTracker(object):
+    def __init__(
+        self,
+        upload_id,
+        bytes_sent=None,
+        initial_interval=DEFAULT_INITIAL_INTERVAL,
+        max_interval=DEFAULT_MAX_INTERVAL,
+        backoff_factor=DEFAULT_BACKOFF_FACTOR,
+    ) -> None:
+        self.upload_id = upload_id
+        self.bytes_sent = bytes_sent
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.polls = 0
+        self.data = None
+
+    def poll(self):
+        self.polls += 1
+        upload_data = utils.get_upload_data(self.upload_id)
+        if isinstance(upload_data, dict):
+            self.data = upload_data
+        return upload_data
+
+    def wait(self, timeout=None, verbose=True):
+        """
+        Poll the job until it leaves the in progress states.
+        Return "complete", "partially_complete", "failed" or "timeout".
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        interval = self.initial_interval
+        last_status = None
+        while True:
+            upload_data = self.poll()
+            if isinstance(upload_data, str):
+                if verbose:
+                    print(f"[-] [{self.upload_id}] {upload_data}")
+                return "failed"
+
+            status = utils.check_upload_file_status(upload_data)["status"]
+            if status != "in_progress":
+                return status
+
+            if verbose and upload_data.get("status") != last_status:
+                last_status = upload_data.get("status")
+                status_name = UPLOAD_STATUS_NAMES.get(last_status, last_status)
+                print(f"[{self.upload_id}] {status_name} ({upload_data.get('total_files', 0)} files)")
+
+            if deadline is not None and time.monotonic() + interval > deadline:
+                return "timeout"
+            time.sleep(interval)
+            interval = min(interval * self.backoff_factor, self.max_interval)
+
+    def throughput(self):
+        if self.data is None:
+            return None
+        return throughput(self.data, self.bytes_sent)
@@ -0,0 +1,256 @@
+import io
+import threading
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import lib.bulk as bulk
+import lib.http_client as http_client
+import lib.splitter as splitter
+import lib.upload_index as upload_index
+import lib.utils as utils
+
+# concurrent collection uploader
+# the json files of a collection are sent to the same upload job by a bounded pool of workers.
+# files are scheduled largest first so a single huge file starts early instead of becoming the long tail.
+# files bigger than split_size are sent as several smaller valid documents (lib.splitter).
+
+DEFAULT_WORKERS = 4
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_BACKOFF = 2
+
+_print_lock = threading.Lock()
+
+
+def _log(message):
+    with _print_lock:
+        print(message)
+
+
+def _upload_with_retries(upload_id, name, open_body, length, retries, retry_backoff):
+    # open_body() returns a fresh readable body (context manager) for every attempt
+    error = None
+    for attempt in range(1, retries + 1):
+        try:
+            with open_body() as f:
+                upload_status = utils.upload_file_stream(upload_id, f, length=length)
+            if upload_status == "File uploaded":
+                return None
+            error = upload_status
+        except (requests.RequestException, OSError) as exc:
+            error = f"{type(exc).__name__}: {exc}"
+        if attempt < retries:
+            _log(f"[!] {name}: {error}, retrying ({attempt}/{retries - 1})")
+            time.sleep(retry_backoff * 2 ** (attempt - 1))
+    return error
+
+
+def upload_collection_file(upload_id, collection_file, retries=DEFAULT_RETRIES, retry_backoff=DEFAULT_RETRY_BACKOFF):
+    """
+    Upload a single collection file, retrying with exponential backoff.
+    Return None on success or the last error message.
+    """
+    return _upload_with_retries(
+        upload_id, collection_file.name, collection_file.open, collection_file.size, retries, retry_backoff
+    )
+
+
+def upload_split_file(
+    upload_id,
+    collection_file,
+    split_size=splitter.DEFAULT_SPLIT_SIZE,
+    retries=DEFAULT_RETRIES,
+    retry_backoff=DEFAULT_RETRY_BACKOFF,
+    journal=None,
+):
+    """
+    Upload a large collection file as parts of at most split_size bytes (lib.splitter), each part is
+    retried on its own. Parts listed in the journal are skipped.
+    Files without a meta object are uploaded whole. Return None on success or the last error message.
+    """
+    with collection_file.open() as f:
+        meta = splitter.read_meta(f)
+        if meta is None:
+            _log(f"[!] {collection_file.name}: no meta object, uploading it whole")
+        else:
+            try:
+                for index, part in enumerate(splitter.iter_parts(f, split_size, meta), 1):
+                    part_name = f"{collection_file.name}.part{index}"
+                    if journal is not None and journal.is_done(part_name, len(part)):
+                        continue
+                    error = _upload_with_retries(
+                        upload_id, part_name, lambda: io.BytesIO(part), len(part), retries, retry_backoff
+                    )
+                    if error is not None:
+                        return f"{part_name}: {error}"
+                    if journal is not None:
+                        journal.record_file(upload_id, part_name, len(part))
+                    _log(f"Uploaded {part_name} ({len(part)} bytes)")
+            except ValueError as exc:
+                return str(exc)
+            return None
+    return upload_collection_file(upload_id, collection_file, retries, retry_backoff)
+
+
+def _upload_task(upload_id, collection_file, split_size, retries, journal, index, sha256):
+    # runs in a worker: upload, record in the index
+    started = time.monotonic()
+    if split_size and collection_file.size > split_size:
+        error = upload_split_file(upload_id, collection_file, split_size, retries, DEFAULT_RETRY_BACKOFF, journal)
+    else:
+        error = upload_collection_file(upload_id, collection_file, retries)
+    if error is not None:
+        return "failed", error
+    if index is not None:
+        index.record(sha256, collection_file.name, collection_file.size, upload_id, time.monotonic() - started)
+    return "uploaded", None
+
+
+def upload_files(
+    upload_id,
+    collection_files,
+    workers=DEFAULT_WORKERS,
+    retries=DEFAULT_RETRIES,
+    journal=None,
+    split_size=None,
+    manifest=None,
+    index=None,
+    skip_unchanged=False,
+):
+    """
+    Upload the collection files to upload_id with at most `workers` files in flight.
+    With upload_id None, the job is started (utils.start_or_resume_upload) once there is something to send,
+    nothing is started when every file is skipped.
+    Files bigger than split_size are uploaded in parts (default splitter.DEFAULT_SPLIT_SIZE, 0 sends every file whole).
+    With a journal (lib.journal), files it already lists are skipped and accepted files are recorded.
+    With a manifest (lib.validator), invalid files fail without being sent, byte-identical copies are skipped
+    and files with the most objects go first.
+    With an index (lib.upload_index), the sha256 of uploaded files is recorded and, with skip_unchanged,
+    files already ingested into the current database are not sent.
+    Return a dict with the upload id, the uploaded, skipped and unchanged file names, failed files (name -> error),
+    bytes sent, the bytes / upload seconds saved by skipping unchanged files and an error if the job didn't start.
+    """
+    workers = max(1, workers)
+    if split_size is None:
+        split_size = splitter.DEFAULT_SPLIT_SIZE
+    # one pooled connection per worker, otherwise urllib3 would discard connections
+    http_client.ensure_pool_size(workers)
+
+    result = {
+        "upload_id": upload_id,
+        "uploaded": [],
+        "skipped": [],
+        "unchanged": [],
+        "failed": {},
+        "bytes": 0,
+        "bytes_saved": 0,
+        "seconds_saved": 0.0,
+        "error": None,
+    }
+    entries = {}
+    if manifest is not None:
+        entries = {entry["name"]: entry for entry in manifest["files"]}
+        pending_files = []
+        seen_hashes = set()
+        for collection_file in collection_files:
+            entry = entries.get(collection_file.name)
+            if entry is None or (entry["size"], entry.get("mtime")) != (collection_file.size, collection_file.mtime):
+                # not in the manifest or changed since it was validated
+                entries.pop(collection_file.name, None)
+            elif entry["errors"]:
+                result["failed"][collection_file.name] = f"invalid: {'; '.join(entry['errors'])}"
+                _log(f"Not uploading {collection_file.name}, invalid: {'; '.join(entry['errors'])}")
+                continue
+            elif entry["sha256"] in seen_hashes:
+                result["skipped"].append(collection_file.name)
+                _log(f"Skipping {collection_file.name}, identical to another file of the collection")
+                continue
+            else:
+                seen_hashes.add(entry["sha256"])
+            pending_files.append(collection_file)
+        collection_files = pending_files
+
+    if journal is not None:
+        pending_files = []
+        already_uploaded = []
+        for collection_file in collection_files:
+            if journal.is_done(collection_file.name, collection_file.size):
+                already_uploaded.append(collection_file.name)
+            else:
+                pending_files.append(collection_file)
+        if already_uploaded:
+            _log(f"Skipping {len(already_uploaded)} files already uploaded")
+        result["skipped"].extend(already_uploaded)
+        collection_files = pending_files
+
+    # sha256 of every file for the index, from the manifest or hashed concurrently
+    hashes = {name: entry["sha256"] for name, entry in entries.items()}
+    if index is not None:
+        unhashed_files = [collection_file for collection_file in collection_files if collection_file.name not in hashes]
+        for collection_file, sha256, exc in bulk.run_concurrent(upload_index.file_sha256, unhashed_files, workers):
+            if exc is not None:
+                result["failed"][collection_file.name] = f"{type(exc).__name__}: {exc}"
+                _log(f"Failed to read {collection_file.name}: {exc}")
+            else:
+                hashes[collection_file.name] = sha256
+        collection_files = [collection_file for collection_file in collection_files if collection_file.name in hashes]
+
+    if skip_unchanged and index is not None:
+        pending_files = []
+        for collection_file in collection_files:
+            ingested = index.ingested(hashes[collection_file.name])
+            if ingested is None:
+                pending_files.append(collection_file)
+                continue
+            previous_upload_id, upload_seconds = ingested
+            result["unchanged"].append(collection_file.name)
+            result["bytes_saved"] += collection_file.size
+            result["seconds_saved"] += upload_seconds
+            _log(f"Skipping {collection_file.name}, unchanged since upload {previous_upload_id}")
+        collection_files = pending_files
+
+    if not collection_files:
+        return result
+    if upload_id is None:
+        new_upload = utils.start_or_resume_upload(journal)
+        if isinstance(new_upload, str):
+            result["error"] = new_upload
+            return result
+        upload_id = result["upload_id"] = new_upload["id"]
+
+    # ingest time follows the number of objects, the size is all we know without a manifest
+    ordered_files = sorted(
+        collection_files,
+        key=lambda collection_file: (
+            entries[collection_file.name]["count"] if collection_file.name in entries else 0,
+            collection_file.size,
+        ),
+        reverse=True,
+    )
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for collection_file in ordered_files:
+            future = bulk.submit(
+                executor,
+                _upload_task,
+                upload_id,
+                collection_file,
+                split_size,
+                retries,
+                journal,
+                index,
+                hashes.get(collection_file.name),
+            )
+            futures[future] = collection_file
+        for future in as_completed(futures):
+            collection_file = futures[future]
+            status, detail = future.result()
+            if status == "uploaded":
+                if journal is not None:
+                    journal.record_file(upload_id, collection_file.name, collection_file.size)
+                result["uploaded"].append(collection_file.name)
+                result["bytes"] += collection_file.size
+                _log(f"Uploaded {collection_file.name} ({collection_file.size} bytes)")
+            else:
+                result["failed"][collection_file.name] = detail
+                _log(f"Failed to upload {collection_file.name}: {detail}")
+    return result
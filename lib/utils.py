@@ -1,17 +1,24 @@
 import subprocess
 import lib.config as config
+import lib.databases as databases
 import requests
 import random
 import string
 import os
 import lib.bh_utils as bh_utils
-import zipfile
-import shutil
-import json
-import time
+import lib.http_client as http_client
+import lib.rate_limit as rate_limit
+import lib.collection as collection
+import lib.delta as delta
+import lib.uploader as uploader
+import lib.upload_tracker as upload_tracker
+import lib.upload_index as upload_index
 
 current_dir = os.getcwd()
-docker_compose_dir = config.load_env_variables()["docker_compose_dir"]
+
+
+def _docker_compose_dir():
+    return config.load_env_variables()["docker_compose_dir"]
 
 
 def check_is_up():
@@ -19,6 +26,10 @@ def check_is_up():
     try:
         url = config.base_url() + "/api/v2/sso-providers"
         response = requests.get(url, timeout=10)
+        # a 429 still means the server is up, but the shared rate limiter has to slow down
+        if response.status_code == 429:
+            limiter = rate_limit.get_limiter(config.base_url())
+            limiter.on_throttle(rate_limit.parse_retry_after(response.headers.get("Retry-After")))
         # If we get any response (including 429 rate limit), the server is up
         # 200-299: Success
         # 400-499: Client errors (but server is responding)
@@ -41,7 +52,7 @@ def check_is_up():
 
 def start_containers():
     # check for docker compose file
-    if os.path.exists(os.path.join(docker_compose_dir, "docker-compose.yml")):
+    if os.path.exists(os.path.join(_docker_compose_dir(), "docker-compose.yml")):
         # docker compose up --remove-orphans -d
         os.system("docker compose up --remove-orphans --pull=always -d")
     elif os.path.exists(os.path.join(current_dir, "docker-compose.yml")):
@@ -53,7 +64,7 @@ def start_containers():
 
 def stop_containers():
     # check for docker compose file
-    if os.path.exists(os.path.join(docker_compose_dir, "docker-compose.yml")):
+    if os.path.exists(os.path.join(_docker_compose_dir(), "docker-compose.yml")):
         # docker compose down
         os.system("docker compose down")
     elif os.path.exists(os.path.join(current_dir, "docker-compose.yml")):
@@ -65,7 +76,7 @@ def stop_containers():
 
 def restart_containers():
     # check for docker compose file
-    if os.path.exists(os.path.join(docker_compose_dir, "docker-compose.yml")):
+    if os.path.exists(os.path.join(_docker_compose_dir(), "docker-compose.yml")):
         # docker compose down
         os.system("docker compose down")
         # docker compose up --remove-orphans -d
@@ -81,7 +92,7 @@ def restart_containers():
 
 def show_docker_logs():
     # check for docker compose file
-    if os.path.exists(os.path.join(docker_compose_dir, "docker-compose.yml")):
+    if os.path.exists(os.path.join(_docker_compose_dir(), "docker-compose.yml")):
         os.system("docker compose logs -f")
     elif os.path.exists(os.path.join(current_dir, "docker-compose.yml")):
         os.system("docker compose logs -f")
@@ -117,7 +128,7 @@ def generate_password():
 
 
 def retrieve_initial_password():
-    os.chdir(docker_compose_dir)
+    os.chdir(_docker_compose_dir())
     # Run the `docker compose logs` command and capture the output
     logs = subprocess.run(["docker", "compose", "logs"], capture_output=True, text=True).stdout
     os.chdir(current_dir)
@@ -136,9 +147,9 @@ def retrieve_initial_password():
 
 def login_get_token(method, uri, username, password):
     data = {"login_method": "secret", "username": username, "secret": password}
-    headers = {"User-Agent": "bhe-python-sdk 0001", "Content-Type": "application/json"}
+    headers = {"User-Agent": http_client.USER_AGENT, "Content-Type": "application/json"}
     url = config.base_url() + uri
-    response = requests.request(method, url, headers=headers, json=data)
+    response = http_client.request(method, url, headers=headers, json=data)
     response_json = response.json()
 
     # Check if 'data' is in the response
@@ -161,12 +172,12 @@ def login_get_token(method, uri, username, password):
 def change_password(method, uri, bearer_token, current_password, new_password):
     data = {"current_secret": current_password, "needs_password_reset": False, "secret": new_password}
     headers = {
-        "User-Agent": "bhe-python-sdk 0001",
+        "User-Agent": http_client.USER_AGENT,
         "Content-Type": "application/json",
         "Authorization": f"Bearer {bearer_token}",
     }
     url = config.base_url() + uri
-    response = requests.request(method, url, headers=headers, json=data)
+    response = http_client.request(method, url, headers=headers, json=data)
     print(f"change_password new password: {new_password}")
     return response
 
@@ -200,12 +211,12 @@ def create_initial_api_key(bearer_token, user_id, token_name):
     uri = f"/api/v2/tokens"
     data = {"token_name": token_name, "user_id": user_id}
     headers = {
-        "User-Agent": "bhe-python-sdk 0001",
+        "User-Agent": http_client.USER_AGENT,
         "Content-Type": "application/json",
         "Authorization": f"Bearer {bearer_token}",
     }
     url = config.base_url() + uri
-    response = requests.request(method, url, headers=headers, json=data)
+    response = http_client.request(method, url, headers=headers, json=data)
     return response.json()
 
 
@@ -226,34 +237,14 @@ def update_env_api_key(api_key_response):
     token_id = api_key_response["data"]["id"]
     token_key = api_key_response["data"]["key"]
 
-    config.update_env_variables("BHE_TOKEN_ID", token_id)
-    config.update_env_variables("BHE_TOKEN_KEY", token_key)
+    config.update_env_variables_batch({"BHE_TOKEN_ID": token_id, "BHE_TOKEN_KEY": token_key})
     return [token_id, token_key, token_name]
 
 
-def list_neo4j_databases(neo4j_data_dir=os.path.join(os.getcwd(), "data", "neo4j-data")):
-    # list the directories in the neo4j data directory
-    # return the directories
-    neo4j_data_dir = os.path.join(neo4j_data_dir, "databases")
-    directories = [
-        d
-        for d in os.listdir(neo4j_data_dir)
-        if d not in ["system", "logs", "store_lock", "transactions", "server_id", "dbms", "databases"]
-    ]
-    return directories
-
-
-def get_current_db():
-    # GET, /api/v2/database
-    current_db = config.load_env_variables()["neo4j_database_name"]
-
-    return current_db
-
-
-def set_current_db(db_name):
-    # set the current database in the .env file
-    config.update_env_variables("NEO4J_DATABASE_NAME", db_name)
-    return db_name
+# kept here for backward compatibility, they live in lib.databases so local-only commands don't import requests
+list_neo4j_databases = databases.list_neo4j_databases
+get_current_db = databases.get_current_db
+set_current_db = databases.set_current_db
 
 
 # /api/v2/clear-database
@@ -273,6 +264,18 @@ def clear_inject_history():
         return "Failed to clear database"
 
 
+def forget_ingested():
+    # the graph data of the current database is gone, nothing can be skipped as already ingested anymore
+    if os.path.exists(upload_index.index_path()):
+        index = upload_index.UploadIndex()
+        index.forget()
+        index.close()
+    if os.path.exists(delta.snapshot_path()):
+        snapshot = delta.Snapshot()
+        snapshot.forget()
+        snapshot.close()
+
+
 def delete_all_data():
     data = {
         "deleteAssetGroupSelectors": [1, 2],
@@ -283,6 +286,7 @@ def delete_all_data():
     }
     response = bh_utils.pass_request("POST", "/api/v2/clear-database", data)
     if response.status_code == 200:
+        forget_ingested()
         return "All data deleted"
     else:
         return "Failed to delete all data"
@@ -333,49 +337,146 @@ def upload_file(upload_id, data):
         return "Failed to upload file"
 
 
-def upload_file_process(upload_id, data_path):
+def upload_file_stream(upload_id, file_obj, content_type="application/json", length=None):
+    # POST, /api/v2/file-upload/:upload_id
+    # the file is streamed as is, no json parsing / re-serialization, gzip encoded when enabled
+    response = bh_utils.pass_request_stream(
+        "POST",
+        f"/api/v2/file-upload/{upload_id}",
+        file_obj,
+        content_type,
+        length,
+        compress=content_type == "application/json",
+    )
+    if response.status_code in [200, 202]:
+        return "File uploaded"
+    else:
+        return "Failed to upload file"
+
+
+def start_or_resume_upload(upload_journal=None):
+    """
+    Reuse the upload job the journal left open if BloodHound still accepts files for it,
+    otherwise start a new one. Return the upload data or "Failed to initialize upload".
+    """
+    if upload_journal is not None:
+        upload_id = upload_journal.open_upload_id()
+        if upload_id is not None:
+            upload_data = get_upload_data(upload_id)
+            # ready / running jobs still take files
+            if isinstance(upload_data, dict) and upload_data.get("status") in (0, 1):
+                print(f"Resuming upload {upload_id}")
+                return upload_data
+            # the job is gone or closed, what it accepted was ingested with it
+            upload_journal.end(upload_id)
+    new_upload = initialize_upload()
+    if upload_journal is not None and not isinstance(new_upload, str):
+        upload_journal.start(new_upload["id"])
+    return new_upload
+
+
+def upload_file_process(
+    upload_id,
+    data_path,
+    send_zip=False,
+    workers=None,
+    upload_journal=None,
+    split_size=None,
+    manifest=None,
+    index=None,
+    skip_unchanged=False,
+):
+    """
+    Send a collection to upload_id and end the upload job. With upload_id None, a job is started
+    (start_or_resume_upload) only when there is something to send.
+    Return the uploader result (upload_id, uploaded, skipped, unchanged, failed, bytes, bytes_saved, seconds_saved)
+    with an "error" message when the process itself failed.
+    """
+    if workers is None:
+        workers = uploader.DEFAULT_WORKERS
+    upload_result = {
+        "upload_id": upload_id,
+        "uploaded": [],
+        "skipped": [],
+        "unchanged": [],
+        "failed": {},
+        "bytes": 0,
+        "bytes_saved": 0,
+        "seconds_saved": 0.0,
+        "error": None,
+    }
     try:
-        current_dir = os.getcwd()
         # POST, /api/v2/file-upload/:upload_id
-        # check if data_path is a dir or a zip file
-        # if is a zip, unzip it to a temp dir (data/temp)
-        # if is a dir, copy the dir to data/temp
-        if data_path.endswith(".zip"):
-            with zipfile.ZipFile(data_path, "r") as zip_ref:
-                zip_ref.extractall(os.path.join(current_dir, "data", "temp"))
-            data_path = os.path.join(current_dir, "data", "temp")
+        # files are read in place, from the directory or straight from the zip members,
+        # and sent by `workers` concurrent uploads (largest files first)
+        # with send_zip, a zip collection is sent as a single application/zip upload
+        # with upload_journal, files accepted by a previous run are skipped
+        # files bigger than split_size are sent as several smaller documents (0 disables)
+        # with a manifest (lib.validator), invalid files and duplicates are left out
+        # with an index (lib.upload_index) uploaded files are recorded, skip_unchanged leaves out files already ingested
+        if send_zip and collection.is_zip_collection(data_path):
+            zip_name = os.path.basename(data_path)
+            zip_size = os.path.getsize(data_path)
+            if upload_journal is not None and upload_journal.is_done(zip_name, zip_size):
+                print(f"Skipping {zip_name}, already uploaded")
+                upload_result["skipped"].append(zip_name)
+            else:
+                if upload_result["upload_id"] is None:
+                    new_upload = start_or_resume_upload(upload_journal)
+                    if isinstance(new_upload, str):
+                        upload_result["error"] = new_upload
+                        return upload_result
+                    upload_result["upload_id"] = new_upload["id"]
+                print(f"Uploading {zip_name}")
+                with open(data_path, "rb") as f:
+                    upload_status = upload_file_stream(upload_result["upload_id"], f, "application/zip")
+                if upload_status != "File uploaded":
+                    print(f"Failed to upload {data_path}")
+                    upload_result["failed"][zip_name] = upload_status
+                else:
+                    upload_result["uploaded"].append(zip_name)
+                    upload_result["bytes"] = zip_size
+                    if upload_journal is not None:
+                        upload_journal.record_file(upload_result["upload_id"], zip_name, zip_size)
         else:
-            # make sure data/temp exists
-            if not os.path.exists(os.path.join(current_dir, "data", "temp")):
-                os.makedirs(os.path.join(current_dir, "data", "temp"))
-            # copy the folder content to data/temp
-            for file in os.listdir(data_path):
-                if file.endswith(".json"):
-                    shutil.copy(os.path.join(data_path, file), os.path.join(current_dir, "data", "temp"))
-            data_path = os.path.join(current_dir, "data", "temp")
-        temp_dir = os.path.join(current_dir, "data", "temp")
-        # parse json in the dir
-        for file in os.listdir(temp_dir):
-            if file.endswith(".json"):
-                print(f"Uploading {file}")
-                with open(os.path.join(temp_dir, file), "r") as f:
-                    json_data = json.load(f)
-                    # print(json_data)
-                    upload_file(upload_id, json_data)
-        # end the upload
-        print(f"Ending upload {upload_id}")
-        end_upload(upload_id)
-        # delete the temp dir
-        shutil.rmtree(temp_dir)
-        return "File upload process completed"
+            collection_files = collection.list_collection_files(data_path)
+            print(f"Uploading {len(collection_files)} files with {workers} workers")
+            upload_result.update(
+                uploader.upload_files(
+                    upload_id,
+                    collection_files,
+                    workers,
+                    journal=upload_journal,
+                    split_size=split_size,
+                    manifest=manifest,
+                    index=index,
+                    skip_unchanged=skip_unchanged,
+                )
+            )
+            if upload_result["unchanged"]:
+                print(
+                    f"[+] Skipped {len(upload_result['unchanged'])} unchanged files: "
+                    f"{upload_result['bytes_saved']} bytes and ~{upload_result['seconds_saved']:.1f}s of upload saved"
+                )
+            if upload_result["failed"]:
+                print(f"[-] {len(upload_result['failed'])} files failed to upload")
+                retryable = [error for error in upload_result["failed"].values() if not error.startswith("invalid:")]
+                if upload_journal is not None and retryable:
+                    print("[-] Run again with --resume to upload only the files that failed")
     except Exception as e:
         print(f"Error uploading file: {e}")
+        upload_result["error"] = f"Failed to upload file: {e}"
+    finally:
+        # a resumed job with nothing left to send still has to be ended for its files to be ingested
+        if upload_result["upload_id"] is None and upload_journal is not None:
+            upload_result["upload_id"] = upload_journal.open_upload_id()
         # end the upload
-        print(f"Ending upload {upload_id}")
-        end_upload(upload_id)
-        # delete the temp dir
-        shutil.rmtree(temp_dir)
-        return f"Failed to upload file: {e}"
+        if upload_result["upload_id"] is not None:
+            print(f"Ending upload {upload_result['upload_id']}")
+            end_upload(upload_result["upload_id"])
+            if upload_journal is not None:
+                upload_journal.end(upload_result["upload_id"])
+    return upload_result
 
 
 def get_latest_upload_data():
@@ -389,6 +490,18 @@ def get_latest_upload_data():
         return "Failed to get upload status"
 
 
+def get_upload_data(upload_id):
+    # GET, /api/v2/file-upload?id=eq:<upload_id>
+    response = bh_utils.pass_request("GET", f"/api/v2/file-upload?skip=0&limit=1&id=eq:{upload_id}")
+    if response.status_code == 200:
+        response_data = response.json()["data"]
+        if response_data:
+            return response_data[0]
+        return f"Upload {upload_id} not found"
+    else:
+        return "Failed to get upload status"
+
+
 def check_upload_file_status(data):
     status = data["status"]
     # Simple status checking
@@ -404,19 +517,42 @@ def check_upload_file_status(data):
         return {"status": "failed"}
 
 
-def wait_for_upload_complete():
-    upload_status_data = get_latest_upload_data()
-    upload_status_check = check_upload_file_status(upload_status_data)
+def confirm_upload_index(index, upload_id, status):
+    # files of a complete ingest are known to be in the database, a failed one is forgotten,
+    # a timed out one stays unconfirmed (uploaded again next time)
+    if index is None or status == "timeout":
+        return
+    index.confirm(upload_id, status == "complete")
+
 
-    while upload_status_check["status"] == "in_progress":
-        print(upload_status_check)
-        time.sleep(15)
+def wait_for_upload_complete(upload_id=None, bytes_sent=None, timeout=None):
+    # track the given upload job, or the latest one when no id is given
+    if upload_id is None:
         upload_status_data = get_latest_upload_data()
-        upload_status_check = check_upload_file_status(upload_status_data)
-
-    if upload_status_check["status"] == "complete":
-        print(f"[+] Data import completed: {upload_status_check['status']}")
-    elif upload_status_check["status"] == "partially_complete":
-        print(f"[+] Data import partially completed: {upload_status_check['status']}")
-    elif upload_status_check["status"] == "failed":
-        print(f"[-] Data import failed: {upload_status_check['status']}")
+        if isinstance(upload_status_data, str):
+            print(f"[-] {upload_status_data}")
+            return "failed"
+        upload_id = upload_status_data["id"]
+
+    tracker = upload_tracker.UploadTracker(upload_id, bytes_sent)
+    status = tracker.wait(timeout)
+
+    if status == "complete":
+        print(f"[+] Data import completed: {status}")
+    elif status == "partially_complete":
+        print(f"[+] Data import partially completed: {status}")
+    elif status == "timeout":
+        print(f"[-] Data import still in progress after {timeout}s")
+    else:
+        print(f"[-] Data import failed: {status}")
+
+    ingest_throughput = tracker.throughput()
+    if ingest_throughput is not None:
+        message = (
+            f"[{upload_id}] {ingest_throughput['files']} files in {ingest_throughput['elapsed']}s "
+            f"({ingest_throughput['files_per_second']} files/s"
+        )
+        if "bytes_per_second" in ingest_throughput:
+            message += f", {ingest_throughput['bytes_per_second']} bytes/s"
+        print(message + ")")
+    return status
@@ -0,0 +1,208 @@
+import datetime
+import hashlib
+import json
+import os
+import threading
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import lib.collection as collection
+import lib.splitter as splitter
+
+# pre-upload validation of collection files
+# every json file is parsed in a streaming way on a process pool (one file per process): the layout, meta.type,
+# meta.count against the real number of objects and duplicate ObjectIdentifiers. the result is a manifest
+# (counts per type, sizes, sha256) written next to the collection, the uploader uses it to leave out
+# invalid files and byte-identical copies.
+
+READ_SIZE = 1024 * 1024
+
+
+class _HashingReader(object):
+    """
+    Binary file wrapper hashing everything read through it
+    """
+
+    def __init__(self, file_obj) -> None:
+        self.file_obj = file_obj
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        chunk = self.file_obj.read(size)
+        self.sha256.update(chunk)
+        return chunk
+
+
+def _object_id(element):
+    if not isinstance(element, dict):
+        return None
+    object_id = element.get("ObjectIdentifier")
+    if object_id is None and isinstance(element.get("data"), dict):
+        # azurehound: {"kind": ..., "data": {"id": ...}}
+        object_id = element["data"].get("id")
+    return object_id
+
+
+def _id_hash(object_id) -> int:
+    # 8 bytes per object is enough to find duplicates, and cheap to send back from the worker
+    return int.from_bytes(hashlib.blake2b(str(object_id).encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def validate_file(collection_file):
+    """
+    Validate one collection file, return (manifest entry, object id hashes as bytes).
+    Runs in a worker process.
+    """
+    entry = {
+        "name": collection_file.name,
+        "size": collection_file.size,
+        "mtime": collection_file.mtime,
+        "sha256": None,
+        "type": None,
+        "version": None,
+        "meta_count": None,
+        "count": 0,
+        "duplicate_ids": 0,
+        "errors": [],
+        "warnings": [],
+    }
+    ids = array("Q")
+    seen = set()
+    with collection_file.open() as f:
+        try:
+            meta = splitter.read_meta(f)
+        except (OSError, ValueError) as exc:
+            meta = None
+            entry["errors"].append(f"Failed to read meta: {exc}")
+        if meta is None:
+            entry["errors"].append('no "meta" object')
+        else:
+            entry["type"] = meta.get("type")
+            entry["version"] = meta.get("version")
+            entry["meta_count"] = meta.get("count")
+            if not entry["type"]:
+                entry["errors"].append("no meta.type")
+
+        f.seek(0)
+        reader = _HashingReader(f)
+        try:
+            for element, _ in splitter.iter_values(reader, READ_SIZE):
+                entry["count"] += 1
+                object_id = _object_id(element)
+                if object_id is None:
+                    continue
+                id_hash = _id_hash(object_id)
+                if id_hash in seen:
+                    entry["duplicate_ids"] += 1
+                else:
+                    seen.add(id_hash)
+                    ids.append(id_hash)
+        except ValueError as exc:
+            entry["errors"].append(str(exc))
+        # hash what the parser didn't need (meta after data, or the rest of a broken file)
+        for _ in iter(lambda: reader.read(READ_SIZE), b""):
+            pass
+        entry["sha256"] = reader.sha256.hexdigest()
+
+    if entry["meta_count"] is not None and entry["meta_count"] != entry["count"]:
+        entry["warnings"].append(f"meta.count is {entry['meta_count']} but data has {entry['count']} objects")
+    if entry["duplicate_ids"]:
+        entry["warnings"].append(f"{entry['duplicate_ids']} duplicate object ids")
+    return entry, ids.tobytes()
+
+
+def validate_collection(data_path: str, processes: int = None) -> dict:
+    """
+    Validate every json file of a collection (directory or zip), return the manifest
+    """
+    collection_files = collection.list_collection_files(data_path)
+    processes = max(1, min(processes or os.cpu_count() or 1, len(collection_files) or 1))
+    if processes == 1:
+        results = [validate_file(collection_file) for collection_file in collection_files]
+    else:
+        # largest first so the biggest file doesn't start last
+        ordered_files = sorted(collection_files, key=lambda collection_file: collection_file.size, reverse=True)
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(validate_file, ordered_files))
+        results.sort(key=lambda result: result[0]["name"])
+
+    # duplicates across files, object ids already deduplicated inside each file
+    seen = set()
+    cross_file_duplicates = 0
+    types = {}
+    for entry, id_bytes in results:
+        if entry["errors"]:
+            # a broken file won't be uploaded, its objects can't collide
+            continue
+        ids = array("Q")
+        ids.frombytes(id_bytes)
+        for id_hash in ids:
+            if id_hash in seen:
+                cross_file_duplicates += 1
+            else:
+                seen.add(id_hash)
+        types[entry["type"]] = types.get(entry["type"], 0) + entry["count"]
+
+    files = [entry for entry, _ in results]
+    return {
+        "collection": os.path.abspath(data_path),
+        "created": datetime.datetime.now().astimezone().isoformat(),
+        "ok": not any(entry["errors"] for entry in files),
+        "files": files,
+        "types": types,
+        "total_files": len(files),
+        "total_bytes": sum(entry["size"] for entry in files),
+        "total_objects": sum(entry["count"] for entry in files),
+        "cross_file_duplicate_ids": cross_file_duplicates,
+    }
+
+
+def manifest_path(data_path: str) -> str:
+    return f"{os.path.normpath(os.path.abspath(data_path))}.manifest.json"
+
+
+def write_manifest(manifest: dict, path: str = None) -> str:
+    path = path or manifest_path(manifest["collection"])
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "w") as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(temp_path, path)
+    return path
+
+
+def load_manifest(data_path: str):
+    """
+    Manifest of a collection if it was validated before and no file changed (size, mtime) since, None otherwise
+    """
+    path = manifest_path(data_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r") as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return None
+    # a file rewritten with the same size (one id changed) must not reuse its old sha256
+    stamps = {entry["name"]: (entry["size"], entry.get("mtime")) for entry in manifest.get("files", [])}
+    try:
+        current = {
+            collection_file.name: (collection_file.size, collection_file.mtime)
+            for collection_file in collection.list_collection_files(data_path)
+        }
+    except ValueError:
+        return None
+    return manifest if stamps == current else None
+
+
+def print_report(manifest: dict):
+    for entry in manifest["files"]:
+        status = "FAILED" if entry["errors"] else "ok"
+        print(f"{status:<6} {entry['name']} ({entry['type']}, {entry['count']} objects, {entry['size']} bytes)")
+        for message in entry["errors"] + entry["warnings"]:
+            print(f"       {message}")
+    types = ", ".join(f"{object_type}: {count}" for object_type, count in sorted(manifest["types"].items()))
+    print(
+        f"{manifest['total_files']} files, {manifest['total_objects']} objects ({types}), "
+        f"{manifest['total_bytes']} bytes"
+    )
+    if manifest["cross_file_duplicate_ids"]:
+        print(f"[!] {manifest['cross_file_duplicate_ids']} object ids appear in more than one file")